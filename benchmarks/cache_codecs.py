@@ -0,0 +1,112 @@
+"""
+Compares the cache codecs on the values of our real key families: size
+stored, encode and decode time, and the GET + decode latency and memory
+use of the values in Redis. Values are written under bench:codec:* keys
+that are deleted afterwards.
+
+usage: python -m benchmarks.cache_codecs [matchups]
+"""
+import json
+import re
+import statistics
+import sys
+import time
+
+import redis
+
+from onevone.cache import Codec, cache, decode, json_codec, msgpack_codec
+from onevone.db_manager import DBManager
+from onevone.models import (Champion, Item, Mastery, MatchupAverages, Rune,
+                            SummonerSpell)
+from onevone.utils import MatchContext, StaticDataContext, xy_version_regex
+
+REPEAT = 20
+
+CODECS = [
+    ('legacy json', None),
+    ('json', Codec(json_codec.codec_id, json_codec.dumps, json_codec.loads,
+                   compress_threshold=None)),
+    ('json+zlib', json_codec),
+    ('msgpack', Codec(msgpack_codec.codec_id, msgpack_codec.dumps,
+                      msgpack_codec.loads, compress_threshold=None)),
+    ('msgpack+zlib', msgpack_codec),
+]
+
+
+def encode(codec, value):
+    if codec is None:
+        return json.dumps(value).encode('utf-8')
+    return codec.encode(value)
+
+
+def median_time(f, *args):
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        f(*args)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def memory_usage(key):
+    # MEMORY USAGE needs Redis 4
+    try:
+        return cache.execute_command('MEMORY', 'USAGE', key)
+    except redis.ResponseError:
+        return None
+
+
+def key_families(matchups):
+    families = {}
+    with DBManager.create_session_scope_nc() as session:
+        for model in [Champion, Item, Mastery, Rune, SummonerSpell]:
+            families['{0}:id'.format(model.__name__)] = [
+                {str(o.id): o.serialize() for o in session.query(model)}]
+        version = StaticDataContext.get_api_version()['versions'][0]
+        patch_version = re.sub(xy_version_regex, r'\1', version)
+        rows = session.query(MatchupAverages)\
+            .filter(MatchupAverages.patch_version == patch_version)\
+            .order_by(MatchupAverages.total_games.desc())\
+            .limit(matchups).all()
+        families['matchup'] = [
+            row.render_payload or MatchContext.process_matchup(row)
+            for row in rows]
+        families['mastery_tree'] = [
+            StaticDataContext.get_mastery_tree_template(patch_version)]
+    return families
+
+
+def main(matchups=50):
+    families = key_families(matchups)
+    print('{0:<16} {1:<13} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+        'family', 'codec', 'bytes', 'encode(us)', 'decode(us)', 'get(us)',
+        'redis(B)'))
+    keys = []
+    try:
+        for family, values in sorted(families.items()):
+            if len(values) == 0:
+                continue
+            for name, codec in CODECS:
+                encoded = [encode(codec, value) for value in values]
+                size = sum(len(data) for data in encoded) / len(encoded)
+                encode_time = statistics.mean(
+                    median_time(encode, codec, value) for value in values)
+                decode_time = statistics.mean(
+                    median_time(decode, data) for data in encoded)
+                key = 'bench:codec:{0}:{1}'.format(family, name)
+                keys.append(key)
+                cache.set(key, encoded[0])
+                get_time = median_time(lambda: decode(cache.get(key)))
+                memory = memory_usage(key)
+                print('{0:<16} {1:<13} {2:>10.0f} {3:>10.1f} {4:>10.1f} '
+                      '{5:>10.1f} {6:>10}'.format(
+                        family, name, size, encode_time * 1e6,
+                        decode_time * 1e6, get_time * 1e6,
+                        '-' if memory is None else memory))
+    finally:
+        if len(keys) > 0:
+            cache.delete(*keys)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,119 @@
+"""
+Compares the rows/second of the per-participant ORM inserts that
+populate_single_matchup used to do with the batched MatchupWriter, on
+synthetic match payloads. The benchmark writes to the given database
+and deletes its rows afterwards, so point it at a scratch copy.
+
+usage: python -m benchmarks.matchup_writes <database_uri> [matches]
+"""
+import random
+import sys
+import time
+
+from onevone.db_manager import DBManager
+from onevone.models import Champion, Matchup, ItemTimeline, SpellTimeLine
+from onevone.utils import MatchContext, MatchupWriter
+
+BENCH_PATCH = '0.0'
+LANES = [('TOP', 'SOLO'), ('MIDDLE', 'SOLO'), ('JUNGLE', 'NONE'),
+         ('BOTTOM', 'DUO_CARRY'), ('BOTTOM', 'DUO_SUPPORT')]
+
+
+def synthetic_match(champions, rnd):
+    picks = rnd.sample(champions, 10)
+    participants, events = [], []
+    for pid, champion in enumerate(picks, start=1):
+        lane, role = LANES[(pid - 1) % 5]
+        participants.append({
+            'participantId': pid,
+            'championId': champion,
+            'teamId': 100 if pid <= 5 else 200,
+            'timeline': {'lane': lane, 'role': role},
+            'masteries': [{'masteryId': 6111 + i, 'rank': 1}
+                          for i in range(10)],
+            'runes': [{'runeId': 5245, 'rank': 9},
+                      {'runeId': 5289, 'rank': 9}],
+            'spell1Id': 4,
+            'spell2Id': 14,
+            'stats': {
+                'kills': rnd.randint(0, 15), 'deaths': rnd.randint(0, 15),
+                'assists': rnd.randint(0, 20),
+                'minionsKilled': rnd.randint(0, 300),
+                'totalDamageDealtToChampions': rnd.random() * 40000,
+            },
+        })
+        events += [{'eventType': 'ITEM_PURCHASED', 'participantId': pid,
+                    'itemId': 1001 + rnd.randint(0, 200)}
+                   for _ in range(25)]
+        events += [{'eventType': 'SKILL_LEVEL_UP', 'participantId': pid,
+                    'skillSlot': rnd.randint(1, 4)} for _ in range(18)]
+    return {
+        'teams': [{'teamId': 100, 'winner': True},
+                  {'teamId': 200, 'winner': False}],
+        'participants': participants,
+        'matchDuration': rnd.randint(1200, 2700),
+        'matchVersion': BENCH_PATCH + '.1.1',
+        'timeline': {'frames': [{'events': events}]},
+    }
+
+
+def per_row_inserts(matches):
+    for data in matches:
+        with DBManager.create_session_scope(expire_on_commit=False) as session:
+            for matchup_data, items, spells in \
+                    MatchContext.extract_matchups(data):
+                matchup = Matchup(matchup_data)
+                session.add(matchup)
+                session.flush()
+                session.refresh(matchup)
+                session.add(ItemTimeline({'matchup_id': matchup.id,
+                                          'item_timeline': items}))
+                session.add(SpellTimeLine({'matchup_id': matchup.id,
+                                           'spell_timeline': spells}))
+                session.commit()
+
+
+def batched_inserts(matches, batch_size=25):
+    writer = MatchupWriter()
+    for data in matches:
+        writer.add_match(data)
+        if writer.pending_matches >= batch_size:
+            writer.flush()
+    writer.flush()
+
+
+def cleanup():
+    with DBManager.create_session_scope() as session:
+        ids = session.query(Matchup.id).filter(
+            Matchup.patch_version == BENCH_PATCH).subquery()
+        for model in (ItemTimeline, SpellTimeLine):
+            session.query(model).filter(model.matchup_id.in_(ids))\
+                .delete(synchronize_session=False)
+        session.query(Matchup).filter(Matchup.patch_version == BENCH_PATCH)\
+            .delete(synchronize_session=False)
+
+
+def main(database_uri, match_count=200):
+    DBManager.init(database_uri)
+    with DBManager.create_session_scope_nc() as session:
+        champions = [c for c, in session.query(Champion.id)]
+    rnd = random.Random(0)
+    matches = [synthetic_match(champions, rnd) for _ in range(match_count)]
+    rows = 3 * sum(len(MatchContext.extract_matchups(m)) for m in matches)
+
+    print('{0:<10} {1:>8} {2:>10} {3:>12}'.format(
+        'path', 'rows', 'seconds', 'rows/second'))
+    for name, function in (('per-row', per_row_inserts),
+                           ('batched', batched_inserts)):
+        started = time.time()
+        try:
+            function(matches)
+            elapsed = time.time() - started
+        finally:
+            cleanup()
+        print('{0:<10} {1:>8} {2:>10.2f} {3:>12.0f}'.format(
+            name, rows, elapsed, rows / elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], *[int(arg) for arg in sys.argv[2:]])
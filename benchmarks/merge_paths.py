@@ -0,0 +1,55 @@
+"""
+Micro-benchmark of folding a few new games into the stored path counts of
+a pair, as populate_averages does, against rescanning every game of the
+pair with the previous filter-per-position implementation. Exits with an
+error when the fold is slower on any size or does not return the same
+path.
+
+usage: python -m benchmarks.merge_paths [stored_sequences ...]
+"""
+import json
+import sys
+
+from benchmarks.timelines_average import filter_path, item_timelines, timed
+from onevone.aggregation import merge_paths, most_common_path, path_trie
+
+NEW_GAMES = 10
+
+
+def fold(stored, new):
+    return most_common_path(merge_paths(stored, path_trie(new)))
+
+
+def main(sizes=(100, 1000, 10000, 100000)):
+    """
+    Returns whether the fold was correct and cheaper everywhere
+    """
+    ok = True
+    print('{0:>10} {1:>12} {2:>12} {3:>8} {4:>12}'.format(
+        'stored', 'rescan(ms)', 'fold(ms)', 'speedup', 'stored(KB)'))
+    for size in sizes:
+        data = item_timelines(size)
+        new = item_timelines(NEW_GAMES, seed=1)
+        # Stored counts come back from a JSONB column
+        encoded = json.dumps(path_trie(data))
+        stored = json.loads(encoded)
+        rescan_time, expected = timed(filter_path, data + new)
+        fold_time, result = timed(lambda n: fold(stored, n), new)
+        if result != expected:
+            print('[!] Wrong path for {0} stored sequences'.format(size))
+            ok = False
+        if fold_time > rescan_time:
+            print('[!] Fold slower for {0} stored sequences'.format(size))
+            ok = False
+        print('{0:>10} {1:>12.2f} {2:>12.2f} {3:>7.1f}x {4:>12.0f}'.format(
+            size, rescan_time * 1000, fold_time * 1000,
+            rescan_time / fold_time, len(encoded) / 1024))
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        ok = main([int(arg) for arg in sys.argv[1:]])
+    else:
+        ok = main()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,141 @@
+"""
+Times the per-pair averages loop against the single-pass aggregation for
+the latest patches, and checks that both produce the same numbers. Both
+paths rescan every matchup of the patch and only read from the database.
+
+usage: python -m benchmarks.populate_averages [patch_count]
+"""
+import re
+import sys
+import time
+
+from onevone.db_manager import DBManager
+from onevone.models import Champion, Matchup, SpellTimeLine, ItemTimeline
+from onevone.utils import StaticDataContext, xy_version_regex
+from onevone import aggregation
+
+from sqlalchemy.orm import load_only
+
+NUMERIC_COLUMNS = [Matchup.champion, Matchup.enemy, Matchup.patch_version,
+                   Matchup.won, Matchup.kills, Matchup.deaths,
+                   Matchup.assists, Matchup.damage_dealt,
+                   Matchup.creep_score, Matchup.duration]
+PATH_COLUMNS = [Matchup.masteries, Matchup.runes, Matchup.summoners,
+                SpellTimeLine.spell_timeline, ItemTimeline.item_timeline]
+
+
+def matchups(session, *columns):
+    return session.query(*columns)\
+        .join(SpellTimeLine, (Matchup.id == SpellTimeLine.matchup_id))\
+        .join(ItemTimeline, (Matchup.id == ItemTimeline.matchup_id))
+
+
+def python_statistics(rows):
+    kills = 0
+    deaths = 0
+    assists = 0
+    damage_dealt = 0
+    wins = 0
+    creep_score = 0
+    duration = 0
+    for row in rows:
+        if row.won:
+            wins += 1
+        kills += row.kills
+        deaths += row.deaths
+        assists += row.assists
+        damage_dealt += row.damage_dealt
+        creep_score += row.creep_score
+        duration += row.duration
+    return {
+        'total_games': len(rows),
+        'kills': kills,
+        'deaths': deaths,
+        'assists': assists,
+        'creep_score': creep_score,
+        'damage_dealt': damage_dealt,
+        'duration': duration,
+        'wins': wins,
+    }
+
+
+def per_pair_averages(session, patch_version):
+    champions = [c.id for c in session.query(Champion).options(
+        load_only('id')).order_by('id').all()]
+    ret = []
+    for idA in champions:
+        for idB in champions:
+            if idA == idB:
+                continue
+            rows = matchups(session, *(NUMERIC_COLUMNS + PATH_COLUMNS))\
+                .filter((Matchup.champion == idA) & (Matchup.enemy == idB) &
+                        (Matchup.patch_version == patch_version)).all()
+            if len(rows) == 0:
+                continue
+            stats = dict(python_statistics(rows),
+                         **aggregation.path_statistics(rows))
+            ret.append(dict(aggregation.averages(stats),
+                            champion=idA, enemy=idB))
+    return ret
+
+
+def single_pass_averages(session, patch_version):
+    statistics = aggregation.matchup_statistics(
+        matchups(session, *NUMERIC_COLUMNS)
+        .filter(Matchup.patch_version == patch_version).all())
+    rows = matchups(session, Matchup.champion, Matchup.enemy, *PATH_COLUMNS)\
+        .filter(Matchup.patch_version == patch_version)\
+        .order_by(Matchup.champion, Matchup.enemy)\
+        .yield_per(1000)
+    ret = []
+    for (champion, enemy), group in aggregation.group_matchups(rows):
+        stats = dict(statistics[(champion, enemy, patch_version)],
+                     **aggregation.path_statistics(group))
+        ret.append(dict(aggregation.averages(stats),
+                        champion=champion, enemy=enemy))
+    return ret
+
+
+def mismatches(legacy, single):
+    key = lambda avg: (avg['champion'], avg['enemy'])
+    single = {key(avg): avg for avg in single}
+    ret = 0
+    for avg in legacy:
+        other = single.get(key(avg), {})
+        for name, value in avg.items():
+            if isinstance(value, float):
+                if abs(value - other.get(name, float('nan'))) > 1e-9 * \
+                        max(1.0, abs(value)):
+                    ret += 1
+            elif value != other.get(name):
+                ret += 1
+    return ret
+
+
+def main(patch_count=2):
+    versions = StaticDataContext.get_api_version()['versions'][:patch_count]
+    print('{0:<10} {1:>8} {2:>12} {3:>12} {4:>8}'.format(
+        'patch', 'pairs', 'per-pair(s)', 'single(s)', 'speedup'))
+    with DBManager.create_session_scope_nc() as session:
+        for version in versions:
+            patch_version = re.sub(xy_version_regex, r'\1', version)
+            started = time.time()
+            legacy = per_pair_averages(session, patch_version)
+            legacy_time = time.time() - started
+            started = time.time()
+            single = single_pass_averages(session, patch_version)
+            single_time = time.time() - started
+            if len(legacy) != len(single):
+                print('[!] Pair count mismatch for patch {0}: {1} vs {2}'
+                      .format(patch_version, len(legacy), len(single)))
+            different = mismatches(legacy, single)
+            if different > 0:
+                print('[!] {0} differing values for patch {1}'.format(
+                    different, patch_version))
+            print('{0:<10} {1:>8} {2:>12.2f} {3:>12.2f} {4:>7.1f}x'.format(
+                patch_version, len(single), legacy_time, single_time,
+                legacy_time / max(single_time, 1e-9)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
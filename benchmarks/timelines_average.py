@@ -0,0 +1,116 @@
+"""
+Micro-benchmark of the build path average over synthetic item timelines
+of realistic sizes, comparing the prefix trie walk with the previous
+filter-per-position implementation. Exits with an error when the trie is
+slower on any size or does not return the same path.
+
+usage: python -m benchmarks.timelines_average [sequences ...]
+"""
+import random
+import sys
+import time
+
+from onevone.aggregation import PathTrie
+
+ITEM_POOL = 200
+STARTERS = 12
+TIMELINE_LENGTH = (15, 35)
+
+
+def filter_path(data=[]):
+    ret = []
+    bag = list(filter(lambda x: len(x) > 0, data))
+    idx = 0
+    data_keys = ({k: None for entry in data for k in entry}).keys()
+    while len(bag) > 0:
+        freq_table = {k: 0 for k in data_keys}
+        for entry in bag:
+            val = entry[idx]
+            freq_table[val] += 1
+        max_s = max(freq_table, key=freq_table.get)
+        ret.append(max_s)
+        bag = list(filter(lambda x: x[idx] == max_s, bag))
+        bag = list(filter(lambda x: len(x) > idx + 1, bag))
+        idx += 1
+    return ret
+
+
+def item_timelines(count, seed=0):
+    # Builds start from a handful of starter items and then draw from a
+    # skewed pool, which is roughly what purchase events look like
+    rnd = random.Random(seed)
+    items = list(range(1001, 1001 + ITEM_POOL))
+    weights = [1.0 / (rank + 1) for rank in range(ITEM_POOL)]
+    ret = []
+    for _ in range(count):
+        timeline = [rnd.choice(items[:STARTERS])]
+        timeline += rnd.choices(items, weights=weights,
+                                k=rnd.randint(*TIMELINE_LENGTH))
+        ret.append(timeline)
+    return ret
+
+
+def timed(function, data, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def trie_path(data):
+    trie = PathTrie()
+    trie.extend(data)
+    return trie.most_common_path()
+
+
+def grouped(function, groups):
+    return [function(data) for data in groups]
+
+
+def main(sizes=(100, 1000, 10000, 100000), pairs=2000, games=5):
+    """
+    Returns whether the trie was correct and faster everywhere
+    """
+    ok = True
+    print('{0:>10} {1:>12} {2:>12} {3:>8}'.format(
+        'sequences', 'filter(ms)', 'trie(ms)', 'speedup'))
+    for size in sizes:
+        data = item_timelines(size)
+        filter_time, expected = timed(filter_path, data)
+        trie_time, result = timed(trie_path, data)
+        if result != expected:
+            print('[!] Wrong path for {0} sequences'.format(size))
+            ok = False
+        if trie_time > filter_time:
+            print('[!] Trie slower for {0} sequences'.format(size))
+            ok = False
+        print('{0:>10} {1:>12.2f} {2:>12.2f} {3:>7.1f}x'.format(
+            size, filter_time * 1000, trie_time * 1000,
+            filter_time / trie_time))
+
+    # populate_averages calls it once per pair, most of which have a few
+    # games only
+    groups = [item_timelines(games, seed=seed) for seed in range(pairs)]
+    filter_time, expected = timed(lambda g: grouped(filter_path, g), groups)
+    trie_time, result = timed(lambda g: grouped(trie_path, g), groups)
+    if result != expected:
+        print('[!] Wrong paths for the grouped timelines')
+        ok = False
+    if trie_time > filter_time:
+        print('[!] Trie slower for the grouped timelines')
+        ok = False
+    print('{0:>10} {1:>12.2f} {2:>12.2f} {3:>7.1f}x'.format(
+        '{0}x{1}'.format(pairs, games), filter_time * 1000,
+        trie_time * 1000, filter_time / trie_time))
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        ok = main([int(arg) for arg in sys.argv[1:]])
+    else:
+        ok = main()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,368 @@
+from itertools import chain, groupby, repeat
+
+import numpy as np
+
+STAT_COLUMNS = ['kills', 'deaths', 'assists', 'damage_dealt', 'creep_score',
+                'duration']
+
+# Path counts kept in MatchupStatistics and the MatchupAverages column
+# holding the most common path built from them
+PATH_COLUMNS = [
+    ('item_paths', 'item_timeline'),
+    ('spell_paths', 'spell_timeline'),
+    ('mastery_paths', 'masteries'),
+    ('rune_paths', 'runes'),
+    ('summoner_paths', 'summoners'),
+]
+
+
+class PathTrie(object):
+
+    """
+    Counted prefix trie of sequences. Every node holds how many sequences
+    pass through it and its children. A node keeps the sequences that
+    reached it in a bucket until something needs its children, and is
+    then split once, so a walk only ever pays for the nodes along its own
+    path.
+
+    Nodes are lists laid out as [count, children, sequences, positions,
+    counts]: children maps each value to its node, None while the node is
+    unsplit, and the last three hold its bucket, the position of the next
+    value of every sequence in it and how many times it was added.
+
+    Children travelled as often as each other are told apart by where
+    their value first appears in the input, reading the sequences in the
+    order they were added, as the filter-per-position walk this replaces
+    did.
+
+    dump writes the trie out as a dict holding those values in first-seen
+    order and the nested [count, tail, children] lists of its nodes:
+    every sequence through a node goes on with the values in tail, and
+    children holds a [value, node] pair per child
+    """
+
+    def __init__(self):
+        self.root = [0, None, [], [], []]
+        self.sequences = []
+        # First-seen rank of the values of the sequences read so far
+        self.ranks = {}
+        self.ranked = 0
+
+    def add(self, sequence, count=1):
+        self.sequences.append(sequence)
+        node = self.root
+        pos = 0
+        while True:
+            node[0] += count
+            children = node[1]
+            if children is None:
+                node[2].append(sequence)
+                node[3].append(pos)
+                node[4].append(count)
+                return
+            if pos == len(sequence):
+                return
+            child = children.get(sequence[pos])
+            if child is None:
+                children[sequence[pos]] = [count, None, [sequence],
+                                           [pos + 1], [count]]
+                return
+            node = child
+            pos += 1
+
+    def extend(self, sequences):
+        """
+        Adds every sequence in ``sequences`` once
+        """
+        root = self.root
+        if root[1] is not None:
+            for sequence in sequences:
+                self.add(sequence)
+            return
+        sequences = list(sequences)
+        self.sequences.extend(sequences)
+        root[2].extend(sequences)
+        root[3].extend(repeat(0, len(sequences)))
+        root[4].extend(repeat(1, len(sequences)))
+        root[0] += len(sequences)
+
+    def values(self):
+        """
+        Every value in the order it first appears in the input
+        """
+        return list(dict.fromkeys(chain.from_iterable(self.sequences)))
+
+    def first_seen(self, values):
+        """
+        The one of ``values`` that appears first in the input. Only reads
+        as far into it as needed, in growing chunks
+        """
+        ranks = self.ranks
+        chunk = 16
+        while True:
+            seen = [value for value in values if value in ranks]
+            if len(seen) > 0:
+                return min(seen, key=ranks.__getitem__)
+            sequences = self.sequences[self.ranked:self.ranked + chunk]
+            self.ranked += len(sequences)
+            for value in dict.fromkeys(chain.from_iterable(sequences)):
+                ranks.setdefault(value, len(ranks))
+            chunk *= 2
+
+    @staticmethod
+    def split(node):
+        children = {}
+        for sequence, pos, count in zip(node[2], node[3], node[4]):
+            if pos == len(sequence):
+                continue
+            child = children.get(sequence[pos])
+            if child is None:
+                children[sequence[pos]] = [count, None, [sequence],
+                                           [pos + 1], [count]]
+            else:
+                child[0] += count
+                child[2].append(sequence)
+                child[3].append(pos + 1)
+                child[4].append(count)
+        node[1] = children
+        node[2] = node[3] = node[4] = None
+        return children
+
+    def most_common_path(self):
+        """
+        Follows the most travelled child from the root until no sequence
+        goes any further. Ties go to the value seen first in the input
+        """
+        ret = []
+        node = self.root
+        while True:
+            children = node[1]
+            if children is None:
+                if len(node[2]) == 1:
+                    ret.extend(node[2][0][node[3][0]:])
+                    return ret
+                children = self.split(node)
+            value = None
+            best = 0
+            tied = False
+            for child_value, child in children.items():
+                if child[0] > best:
+                    value, best = child_value, child[0]
+                    tied = False
+                elif child[0] == best:
+                    tied = True
+            if value is None:
+                return ret
+            if tied:
+                value = self.first_seen([child_value
+                                         for child_value, child
+                                         in children.items()
+                                         if child[0] == best])
+            ret.append(value)
+            node = children[value]
+
+    def dump(self):
+        """
+        The counts of every prefix, and the values in first-seen order, in
+        a form that survives a JSON round trip. Splits every node
+        """
+        return {'values': self.values(), 'paths': self.dump_node(self.root)}
+
+    @classmethod
+    def dump_node(cls, node):
+        children = node[1]
+        if children is None:
+            sequences, positions = node[2], node[3]
+            tail = (sequences[0][positions[0]:]
+                    if len(sequences) > 0 else [])
+            if all(sequence[pos:] == tail
+                   for sequence, pos in zip(sequences, positions)):
+                return [node[0], list(tail), []]
+            children = cls.split(node)
+        dumped = [[value, cls.dump_node(child)]
+                  for value, child in children.items()]
+        return fold_node([node[0], [], dumped])
+
+
+def fold_node(node):
+    """
+    Folds a single child no sequence stops before into the tail
+    """
+    count, tail, children = node
+    if len(children) == 1 and children[0][1][0] == count:
+        value, (_, child_tail, grandchildren) = children[0]
+        return [count, tail + [value] + child_tail, grandchildren]
+    return node
+
+
+def most_common_path(dumped):
+    """
+    Most common path of a trie written by PathTrie.dump, the same one
+    PathTrie.most_common_path would find
+    """
+    ranks = {value: rank for rank, value in enumerate(dumped['values'])}
+    ret = []
+    node = dumped['paths']
+    while True:
+        _, tail, children = node
+        ret.extend(tail)
+        best = None
+        for child in children:
+            if (best is None or child[1][0] > best[1][0] or
+                    (child[1][0] == best[1][0] and
+                     ranks[child[0]] < ranks[best[0]])):
+                best = child
+        if best is None:
+            return ret
+        ret.append(best[0])
+        node = best[1]
+
+
+def split_tail(count, tail, children, at):
+    """
+    Children of a node whose tail is cut short at ``at``
+    """
+    if at == len(tail):
+        return children
+    return [[tail[at], [count, tail[at + 1:], children]]]
+
+
+def merge_nodes(stored, new):
+    """
+    Adds the counts of new to stored. Only the nodes new reaches are
+    rebuilt, the rest of stored is shared with the result
+    """
+    count, tail, children = stored
+    new_count, new_tail, new_children = new
+    common = 0
+    limit = min(len(tail), len(new_tail))
+    while common < limit and tail[common] == new_tail[common]:
+        common += 1
+    merged = list(split_tail(count, tail, children, common))
+    index = {value: pos for pos, (value, _) in enumerate(merged)}
+    for value, child in split_tail(new_count, new_tail, new_children,
+                                   common):
+        pos = index.get(value)
+        if pos is None:
+            index[value] = len(merged)
+            merged.append([value, child])
+        else:
+            merged[pos] = [value, merge_nodes(merged[pos][1], child)]
+    return fold_node([count + new_count, tail[:common], merged])
+
+
+def merge_paths(stored, new):
+    """
+    Merges two tries written by PathTrie.dump as if the sequences of new
+    had been added after those of stored
+    """
+    seen = set(stored['values'])
+    return {
+        'values': stored['values'] + [value for value in new['values']
+                                      if value not in seen],
+        'paths': merge_nodes(stored['paths'], new['paths']),
+    }
+
+
+def group_matchups(rows):
+    """
+    Splits matchup rows ordered by (champion, enemy) into one group per
+    pair. Both directions of a lane come out of the same scan, mirror
+    matchups are skipped
+    """
+    for key, group in groupby(rows, key=lambda r: (r.champion, r.enemy)):
+        if key[0] == key[1]:
+            continue
+        yield key, list(group)
+
+
+def matchup_statistics(rows):
+    """
+    Computes the running sums, wins and game counts of every
+    (champion, enemy, patch_version) group at once. Each row is a tuple
+    laid out as
+    (champion, enemy, patch_version, won, kills, deaths, assists,
+     damage_dealt, creep_score, duration)
+    """
+    if len(rows) == 0:
+        return {}
+    columns = list(zip(*rows))
+    champions = np.array(columns[0], dtype=np.int64)
+    enemies = np.array(columns[1], dtype=np.int64)
+    patches, patch_idx = np.unique(np.array(columns[2]), return_inverse=True)
+    won = np.array(columns[3], dtype=np.int64)
+    values = np.array(columns[4:], dtype=np.float64)
+
+    order = np.lexsort((enemies, champions, patch_idx))
+    champions = champions[order]
+    enemies = enemies[order]
+    patch_idx = patch_idx[order]
+
+    boundaries = np.empty(len(order), dtype=bool)
+    boundaries[0] = True
+    boundaries[1:] = ((champions[1:] != champions[:-1]) |
+                      (enemies[1:] != enemies[:-1]) |
+                      (patch_idx[1:] != patch_idx[:-1]))
+    starts = np.flatnonzero(boundaries)
+    total_games = np.diff(np.append(starts, len(order)))
+    wins = np.add.reduceat(won[order], starts)
+    sums = np.add.reduceat(values[:, order], starts, axis=1)
+
+    ret = {}
+    for group, start in enumerate(starts):
+        champion, enemy = int(champions[start]), int(enemies[start])
+        if champion == enemy:
+            continue
+        stats = {name: float(sums[column, group])
+                 for column, name in enumerate(STAT_COLUMNS)}
+        stats['total_games'] = int(total_games[group])
+        stats['wins'] = int(wins[group])
+        ret[(champion, enemy, str(patches[patch_idx[start]]))] = stats
+    return ret
+
+
+def path_trie(sequences):
+    trie = PathTrie()
+    trie.extend(sequences)
+    return trie.dump()
+
+
+def path_statistics(rows):
+    summoners = [sorted(row.summoners.split(',')) for row in rows]
+    return {
+        'item_paths': path_trie([row.item_timeline for row in rows]),
+        'spell_paths': path_trie([row.spell_timeline for row in rows]),
+        'mastery_paths': path_trie([row.masteries for row in rows]),
+        'rune_paths': path_trie([row.runes for row in rows]),
+        'summoner_paths': path_trie(summoners),
+    }
+
+
+def merge_statistics(stored, new):
+    """
+    Folds two sets of statistics of the same pair together. Works the
+    same for new matchups on top of stored ones and for rolling several
+    patches into one view
+    """
+    if stored is None:
+        return dict(new)
+    ret = dict(new)
+    for name in STAT_COLUMNS + ['wins', 'total_games']:
+        ret[name] = stored[name] + new[name]
+    for name, _ in PATH_COLUMNS:
+        ret[name] = merge_paths(stored[name], new[name])
+    return ret
+
+
+def averages(statistics):
+    total_games = statistics['total_games']
+    ret = {name: float(statistics[name] / total_games)
+           for name in STAT_COLUMNS}
+    ret['wins'] = statistics['wins']
+    ret['total_games'] = total_games
+    for name, column in PATH_COLUMNS:
+        ret[column] = most_common_path(statistics[name])
+    # The summoners column is text holding the pair as Postgres prints an
+    # array, which is what process_matchup parses
+    ret['summoners'] = '{{{0}}}'.format(','.join(ret['summoners']))
+    return ret
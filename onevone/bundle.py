@@ -0,0 +1,109 @@
+"""
+Read-only bundle of the static data of one patch, written by the updater
+and memory-mapped by every worker, so they all share one copy through the
+page cache.
+
+Layout: BUNDLE_MAGIC, the length of the index as an unsigned 64 bit
+little endian integer, the JSON index and then the msgpack encoded
+records. For every table the index maps each id to the offset and length
+of its record, relative to the first record, and each name to the id of
+the first record carrying it.
+"""
+import json
+import mmap
+import struct
+
+import msgpack
+
+from rest.restclient import atomic_write
+
+BUNDLE_MAGIC = b'OVSB1\n'
+BUNDLE_PATH = '/var/tmp/onevone/static-data/{0}.bundle'
+INDEX_LENGTH = struct.Struct('<Q')
+
+
+def write_bundle(path, patch_version, tables):
+    """
+    tables maps a table name to its serialized records, ordered by id
+    """
+    index = {'patch_version': patch_version, 'tables': {}}
+    records = []
+    offset = 0
+    for table, table_records in tables.items():
+        ids = {}
+        names = {}
+        for record in table_records:
+            data = msgpack.packb(record, use_bin_type=True)
+            record_id = str(record['id'])
+            ids[record_id] = [offset, len(data)]
+            if record.get('name') is not None:
+                names.setdefault(record['name'], record_id)
+            records.append(data)
+            offset += len(data)
+        index['tables'][table] = {'ids': ids, 'names': names}
+    index = json.dumps(index).encode('utf-8')
+
+    with atomic_write(path) as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(INDEX_LENGTH.pack(len(index)))
+        f.write(index)
+        for data in records:
+            f.write(data)
+
+
+class StaticBundle(object):
+
+    """
+    A mapped bundle. Records are decoded on every access, callers get
+    objects of their own
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            raise ValueError('{0} is not a static data bundle'.format(path))
+        start = len(BUNDLE_MAGIC)
+        index_length, = INDEX_LENGTH.unpack_from(self.mmap, start)
+        start += INDEX_LENGTH.size
+        index = json.loads(
+            self.mmap[start:start + index_length].decode('utf-8'))
+        self.patch_version = index['patch_version']
+        self.tables = index['tables']
+        self.records_start = start + index_length
+
+    def close(self):
+        self.mmap.close()
+
+    def record(self, offset, length):
+        start = self.records_start + offset
+        return msgpack.unpackb(self.mmap[start:start + length], raw=False)
+
+    def get(self, table, record_id):
+        entry = self.tables[table]['ids'].get(str(record_id))
+        if entry is None:
+            return None
+        return self.record(*entry)
+
+    def get_many(self, table, record_ids):
+        """
+        The records with the given ids, by id as a string. Missing ids are
+        left out
+        """
+        ids = self.tables[table]['ids']
+        ret = {}
+        for record_id in record_ids:
+            entry = ids.get(str(record_id))
+            if entry is not None:
+                ret[str(record_id)] = self.record(*entry)
+        return ret
+
+    def all(self, table):
+        return {record_id: self.record(*entry)
+                for record_id, entry in self.tables[table]['ids'].items()}
+
+    def find(self, table, name):
+        record_id = self.tables[table]['names'].get(name)
+        if record_id is None:
+            return None
+        return self.get(table, record_id)
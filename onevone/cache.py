@@ -0,0 +1,451 @@
+from collections import OrderedDict, defaultdict
+import json
+import threading
+import time
+import uuid
+import zlib
+
+import msgpack
+import redis
+
+from onevone import log
+
+cache = redis.from_url('redis://localhost:6379/0')
+
+# Incremented whenever cached data goes stale for every worker at once,
+# e.g. when the static data of a new patch is written. Namespaced keys
+# embed it, so entries of older generations are never read again and
+# simply expire
+GENERATION_KEY = 'cache:generation'
+
+# Deletes a lock only if it is still held by whoever set it
+RELEASE_LOCK = cache.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+
+# Starts every value written through a Codec. Plain JSON, which is what
+# was stored before codecs existed, never starts with it
+CODEC_MAGIC = b'\x00'
+COMPRESSED = 0x01
+
+
+class Codec(object):
+
+    """
+    Serializes cached values behind a three byte header: CODEC_MAGIC, the
+    codec id and flags. Payloads longer than compress_threshold bytes are
+    zlib compressed, None never compresses
+    """
+
+    def __init__(self, codec_id, dumps, loads, compress_threshold=1024,
+                 compress_level=6):
+        self.codec_id = codec_id
+        self.dumps = dumps
+        self.loads = loads
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def encode(self, value):
+        data = self.dumps(value)
+        flags = 0
+        if (self.compress_threshold is not None and
+                len(data) > self.compress_threshold):
+            data = zlib.compress(data, self.compress_level)
+            flags |= COMPRESSED
+        return CODEC_MAGIC + bytes((self.codec_id, flags)) + data
+
+
+# msgpack keeps integer dict keys as integers where JSON turns them into
+# strings, cached values should only use string keys
+json_codec = Codec(1, lambda value: json.dumps(value).encode('utf-8'),
+                   lambda data: json.loads(data.decode('utf-8')))
+msgpack_codec = Codec(2, lambda value: msgpack.packb(value,
+                                                     use_bin_type=True),
+                      lambda data: msgpack.unpackb(data, raw=False))
+CODECS = {codec.codec_id: codec for codec in (json_codec, msgpack_codec)}
+
+
+def decode(data):
+    """
+    Decodes a value written by any codec, or a plain JSON one
+    """
+    if data[:1] != CODEC_MAGIC:
+        return json.loads(data.decode('utf-8'))
+    codec = CODECS[data[1]]
+    payload = data[3:]
+    if data[2] & COMPRESSED:
+        payload = zlib.decompress(payload)
+    return codec.loads(payload)
+
+
+class LocalCache(object):
+
+    """
+    In-process LRU of at most size entries, each kept for at most its own
+    timeout. Every entry is dropped when the generation in Redis changes,
+    which is checked at most once every check_interval seconds. Values are
+    shared between callers and must not be mutated
+    """
+
+    def __init__(self, size=1024, check_interval=5):
+        self.size = size
+        self.check_interval = check_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+        self.checked_at = 0
+
+    def get(self, key):
+        """
+        Returns (True, value) on a hit and (False, None) on a miss
+        """
+        self.check_generation()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            self.entries[key] = (value, time.time() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def check_generation(self):
+        now = time.time()
+        if now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        try:
+            generation = cache.get(GENERATION_KEY)
+        except redis.RedisError:
+            return
+        if generation is not None:
+            generation = generation.decode('utf-8')
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+
+local_cache = LocalCache()
+
+
+# Hit and miss counters of every process, added up, with one
+# '<key_format>|<counter>' field per counter
+STATS_KEY = 'cache:stats'
+
+
+def new_counters():
+    return {
+        'local_hits': 0,
+        'hits': 0,
+        'stale_hits': 0,
+        'default_hits': 0,
+        'misses': 0,
+    }
+
+
+class CacheStats(object):
+
+    """
+    Hit and miss counters of this process, per key_format. At most every
+    publish_interval seconds the counts since the last time are added to
+    STATS_KEY, where totals reads those of every process, and logged
+    """
+
+    def __init__(self, publish_interval=60):
+        self.lock = threading.Lock()
+        self.publish_interval = publish_interval
+        self.counters = defaultdict(new_counters)
+        self.pending = defaultdict(new_counters)
+        self.published_at = time.time()
+
+    def incr(self, key_format, counter):
+        with self.lock:
+            self.counters[key_format][counter] += 1
+            self.pending[key_format][counter] += 1
+            due = time.time() - self.published_at >= self.publish_interval
+        if due:
+            self.publish()
+
+    def snapshot(self):
+        with self.lock:
+            return {key_format: dict(counters)
+                    for key_format, counters in self.counters.items()}
+
+    def publish(self):
+        with self.lock:
+            self.published_at = time.time()
+            pending = self.pending
+            self.pending = defaultdict(new_counters)
+        pipe = cache.pipeline()
+        for key_format, counters in pending.items():
+            for counter, value in counters.items():
+                if value > 0:
+                    pipe.hincrby(STATS_KEY, '{0}|{1}'.format(
+                        key_format, counter), value)
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            log.error('Could not publish cache stats: {0}'.format(repr(e)))
+            # Kept for the next try
+            with self.lock:
+                for key_format, counters in pending.items():
+                    for counter, value in counters.items():
+                        self.pending[key_format][counter] += value
+        log.info('Cache stats: {0}'.format(json.dumps(self.snapshot(),
+                                                      sort_keys=True)))
+
+    @staticmethod
+    def totals():
+        """
+        Counters of every process as last published, per key_format
+        """
+        ret = defaultdict(new_counters)
+        for field, value in cache.hgetall(STATS_KEY).items():
+            key_format, counter = field.decode('utf-8').rsplit('|', 1)
+            ret[key_format][counter] = int(value)
+        return dict(ret)
+
+
+cache_stats = CacheStats()
+
+
+def current_generation():
+    local_cache.check_generation()
+    return local_cache.generation or '0'
+
+
+def bump_generation():
+    """
+    Moves every worker to new namespaced keys, and drops their local tier,
+    within check_interval seconds
+    """
+    cache.incr(GENERATION_KEY)
+    local_cache.checked_at = 0
+    local_cache.check_generation()
+
+
+# Set in every hash written by cached_hash, so one HMGET tells a loaded
+# hash from a missing one
+HASH_LOADED_FIELD = '__loaded__'
+
+
+def cached_hash(name, fields, load, timeout=-1, codec=json_codec):
+    """
+    Values of the requested fields of the Redis hash name, by field, read
+    with a single HMGET under the current generation. When the hash is
+    missing it is written whole from the dict returned by load, every
+    value encoded with codec. Fields the hash does not have are left out
+    """
+    key = 'gen{0}:{1}'.format(current_generation(), name)
+    fields = [str(field) for field in fields]
+    values = cache.hmget(key, fields + [HASH_LOADED_FIELD])
+    if values[-1] is not None:
+        cache_stats.incr(name, 'hits')
+        return {field: decode(value)
+                for field, value in zip(fields, values) if value is not None}
+    cache_stats.incr(name, 'misses')
+    mapping = {str(field): value for field, value in load().items()}
+    encoded = {field: codec.encode(value)
+               for field, value in mapping.items()}
+    encoded[HASH_LOADED_FIELD] = 1
+    pipe = cache.pipeline()
+    pipe.hmset(key, encoded)
+    if timeout > 0:
+        pipe.expire(key, timeout)
+    pipe.execute()
+    return {field: mapping[field] for field in fields if field in mapping}
+
+
+class cached(object):
+
+    """
+    Caches the JSON serializable result of the wrapped function in Redis
+    for timeout seconds. With local set, results are also kept in the
+    in-process LRU for at most local_timeout seconds.
+
+    With single_flight set, only the worker holding a Redis lock on a
+    missing key recomputes it. The others serve the stale copy, kept for
+    stale_timeout seconds past timeout, or poll for the new value for up
+    to lock_timeout seconds before computing it themselves.
+
+    With stale_while_revalidate set, a missing key is answered from the
+    stale copy, or else from default if it returns anything, while one
+    background thread recomputes it. Only a cold miss with neither waits
+    for the wrapped function. The wrapped function's refresh attribute
+    recomputes and stores a key unconditionally.
+
+    With namespaced set, values are stored under the current generation,
+    so bump_generation invalidates them all at once. Stale copies and
+    locks are not namespaced, which lets the first reads of a new
+    generation fall back to the previous one's values.
+
+    Values are written with codec and read back with whichever codec
+    wrote them
+    """
+
+    def __init__(self, timeout=-1, key_format='key', local=False,
+                 local_timeout=60, single_flight=False, lock_timeout=10,
+                 stale_timeout=3600, poll_interval=0.05,
+                 stale_while_revalidate=False, default=None,
+                 namespaced=False, codec=json_codec):
+        self.timeout = timeout
+        if not isinstance(key_format, str):
+            raise
+        self.key_format = key_format
+        self.local = local
+        if timeout > 0:
+            local_timeout = min(local_timeout, timeout)
+        self.local_timeout = local_timeout
+        self.single_flight = single_flight
+        self.lock_timeout = lock_timeout
+        self.stale_timeout = stale_timeout
+        self.poll_interval = poll_interval
+        self.stale_while_revalidate = stale_while_revalidate
+        self.default = default
+        self.namespaced = namespaced
+        self.codec = codec
+
+    def live_key(self, cache_key):
+        if not self.namespaced:
+            return cache_key
+        return 'gen{0}:{1}'.format(current_generation(), cache_key)
+
+    def store(self, cache_key, ret):
+        data = self.codec.encode(ret)
+        live_key = self.live_key(cache_key)
+        pipe = cache.pipeline()
+        pipe.set(live_key, data)
+        if self.timeout > 0:
+            pipe.expire(live_key, self.timeout)
+        if self.single_flight or self.stale_while_revalidate:
+            pipe.set(cache_key + ':stale', data)
+            if self.timeout > 0:
+                pipe.expire(cache_key + ':stale',
+                            self.timeout + self.stale_timeout)
+        pipe.execute()
+
+    def load(self, cache_key):
+        ret = cache.get(cache_key)
+        if ret is None:
+            return None
+        return decode(ret)
+
+    def compute(self, cache_key, f, *args, **kwargs):
+        ret = f(*args, **kwargs)
+        if ret is not None:
+            self.store(cache_key, ret)
+        return ret
+
+    def compute_once(self, cache_key, f, *args, **kwargs):
+        lock_key = cache_key + ':lock'
+        token = uuid.uuid4().hex
+        if cache.set(lock_key, token, nx=True,
+                     px=int(self.lock_timeout * 1000)):
+            try:
+                return self.compute(cache_key, f, *args, **kwargs)
+            finally:
+                RELEASE_LOCK(keys=[lock_key], args=[token])
+        ret = self.load(cache_key + ':stale')
+        if ret is not None:
+            cache_stats.incr(self.key_format, 'stale_hits')
+            return ret
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            ret = self.load(self.live_key(cache_key))
+            if ret is not None:
+                return ret
+            if not cache.exists(lock_key):
+                break
+        return self.compute(cache_key, f, *args, **kwargs)
+
+    def revalidate(self, cache_key, f, *args, **kwargs):
+        """
+        Recomputes cache_key on a background thread, unless another worker
+        already holds its lock
+        """
+        lock_key = cache_key + ':lock'
+        token = uuid.uuid4().hex
+        if not cache.set(lock_key, token, nx=True,
+                         px=int(self.lock_timeout * 1000)):
+            return
+
+        def refresh():
+            try:
+                self.compute(cache_key, f, *args, **kwargs)
+            except Exception as e:
+                log.error('Could not refresh {0}: {1}'.format(
+                    cache_key, repr(e)))
+            finally:
+                RELEASE_LOCK(keys=[lock_key], args=[token])
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def serve_stale(self, cache_key, f, *args, **kwargs):
+        ret = self.load(cache_key + ':stale')
+        if ret is not None:
+            cache_stats.incr(self.key_format, 'stale_hits')
+        elif self.default is not None:
+            ret = self.default(*args, **kwargs)
+            if ret is not None:
+                cache_stats.incr(self.key_format, 'default_hits')
+        if ret is None:
+            return None
+        self.revalidate(cache_key, f, *args, **kwargs)
+        return ret
+
+    def __call__(self, f):
+        def decorator(*args, **kwargs):
+            cache_key = self.key_format.format(*args, **kwargs)
+            live_key = self.live_key(cache_key)
+            if self.local:
+                hit, ret = local_cache.get(live_key)
+                if hit:
+                    cache_stats.incr(self.key_format, 'local_hits')
+                    return ret
+            ret = self.load(live_key)
+            if ret is None:
+                cache_stats.incr(self.key_format, 'misses')
+                if self.stale_while_revalidate:
+                    ret = self.serve_stale(cache_key, f, *args, **kwargs)
+                    if ret is not None:
+                        # Kept locally only briefly so the refreshed value
+                        # is picked up soon
+                        if self.local:
+                            local_cache.set(live_key, ret, 1)
+                        return ret
+                if self.single_flight:
+                    ret = self.compute_once(cache_key, f, *args, **kwargs)
+                else:
+                    ret = self.compute(cache_key, f, *args, **kwargs)
+            else:
+                cache_stats.incr(self.key_format, 'hits')
+            if self.local and ret is not None:
+                local_cache.set(live_key, ret, self.local_timeout)
+            return ret
+
+        def refresh(*args, **kwargs):
+            cache_key = self.key_format.format(*args, **kwargs)
+            ret = self.compute(cache_key, f, *args, **kwargs)
+            if self.local and ret is not None:
+                local_cache.set(self.live_key(cache_key), ret,
+                                self.local_timeout)
+            return ret
+        decorator.refresh = refresh
+        return decorator
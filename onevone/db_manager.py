@@ -4,6 +4,7 @@ from contextlib import contextmanager
 
 from sqlalchemy import create_engine
 from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
@@ -47,6 +48,38 @@ class DBManager:
 
         return None
 
+    def bulk_insert(session, model, rows, chunk_size=1000):
+        """
+        Writes rows with multi-row INSERT statements
+        """
+
+        table = model.__table__
+        for start in range(0, len(rows), chunk_size):
+            session.execute(table.insert().values(
+                rows[start:start + chunk_size]))
+
+    def bulk_upsert(session, model, rows, update=True, chunk_size=1000):
+        """
+        Writes rows with multi-row INSERT ... ON CONFLICT statements keyed
+        on the primary key of the model. Existing rows get the supplied
+        columns overwritten, or are left alone when update is False
+        """
+
+        if len(rows) == 0:
+            return
+        table = model.__table__
+        keys = [column.name for column in table.primary_key.columns]
+        for start in range(0, len(rows), chunk_size):
+            stmt = insert(table).values(rows[start:start + chunk_size])
+            if update:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=keys,
+                    set_={name: stmt.excluded[name] for name in rows[0]
+                          if name not in keys})
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+            session.execute(stmt)
+
     @contextmanager
     def create_session_scope(**options):
         session = DBManager.create_session(**options)
@@ -1,6 +1,7 @@
 from onevone.models.static import Champion, Mastery, Item, SummonerSpell, Rune
 from onevone.models.matches import ProPlayer, CheckedMatch, QueuedMatch
-from onevone.models.matchups import Matchup, ItemTimeline, SpellTimeLine, MatchupAverages
+from onevone.models.matchups import (Matchup, ItemTimeline, SpellTimeLine,
+                                     MatchupAverages, MatchupStatistics)
 
 __all__ = [
     "Champion",
@@ -15,4 +16,5 @@ __all__ = [
     "ItemTimeline",
     "SpellTimeLine",
     "MatchupAverages",
+    "MatchupStatistics",
 ]
@@ -2,10 +2,15 @@ class SerializedMixin(object):
 
     # Code taken from http://stackoverflow.com/a/9746249/2277088
 
+    # Columns left out of serialize()
+    serialize_exclude = []
+
     def serialize(self):
         cls = self.__class__
         ret = dict()
         for column in cls.__table__.columns:
+            if column.name in cls.serialize_exclude:
+                continue
             value = getattr(self, column.name)
             if value is not None:
                 ret[column.name] = value
@@ -8,6 +8,7 @@ from sqlalchemy import Text
 from sqlalchemy import Boolean
 from sqlalchemy import ForeignKey
 from sqlalchemy import ARRAY
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import UniqueConstraint
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -111,6 +112,11 @@ class MatchupAverages(SerializedMixin, Base):
     runes = Column(ARRAY(Text))
     summoners = Column(Text)
 
+    # What MatchContext.process_matchup makes of this row, rendered when it
+    # is aggregated so pages never have to
+    render_payload = Column(JSONB)
+
+    serialize_exclude = ['render_payload']
 
     __table_args__ = (UniqueConstraint('champion', 'enemy', 'patch_version',
                       name='matchup_uniq_id'),)
@@ -146,3 +152,36 @@ class MatchupAverages(SerializedMixin, Base):
         self.summoners = data['summoners']
 
         self.patch_version = data['patch_version']
+        self.render_payload = data.get('render_payload')
+
+
+class MatchupStatistics(SerializedMixin, Base):
+
+    # Running sums and build path counts behind MatchupAverages. New
+    # matchups are folded into these and the averages recomputed from
+    # them, so no run ever needs to rescan tb_matchups
+
+    __tablename__ = 'tb_matchup_statistics'
+
+    champion = Column(Integer, ForeignKey(Champion.id),
+                      primary_key=True, index=True)
+    enemy = Column(Integer, ForeignKey(Champion.id),
+                   primary_key=True, index=True)
+    patch_version = Column(Text, index=True, primary_key=True)
+
+    kills = Column(Float)
+    deaths = Column(Float)
+    assists = Column(Float)
+    creep_score = Column(Float)
+    damage_dealt = Column(Float)
+
+    duration = Column(Float)
+    wins = Column(Integer)
+    total_games = Column(Integer)
+
+    # Prefix counts of every path, as written by PathTrie.dump
+    item_paths = Column(JSONB)
+    spell_paths = Column(JSONB)
+    mastery_paths = Column(JSONB)
+    rune_paths = Column(JSONB)
+    summoner_paths = Column(JSONB)
@@ -11,6 +11,10 @@ from sqlalchemy.ext.hybrid import hybrid_property
 class VersionedMixin(object):
     
     patch_version = Column(String(10))
+    # Hash of every other column, lets a repopulation skip unchanged rows
+    content_hash = Column(String(40))
+
+    serialize_exclude = ['content_hash']
 
 class Champion(VersionedMixin, SerializedMixin, Base):
 
@@ -0,0 +1,334 @@
+"""
+Builds the sprite sheets and splash images served from /static/images.
+
+Images are downloaded concurrently into a local store laid out as
+<store>/<patch>/<category>/<image_blob>. An image already stored for an
+older patch is revalidated with its ETag instead of being downloaded
+again, so a version bump only transfers the images that changed. Each
+sheet records a digest of its inputs and is only rebuilt, in a worker
+process, when they change.
+
+Sheets are written as palette PNGs with WebP next to them. Splashes are
+resized to the width the matchup page shows them at and written as
+progressive JPEG and WebP.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+from rest.restclient import TooManyRetries, atomic_write
+
+IMAGES_PER_LINE = 10
+IMAGE_SIZE = 64
+SPLASH_WIDTH = 308
+SPLASH_JPEG_QUALITY = 85
+WEBP_QUALITY = 90
+STORE_PATH = '/var/tmp/onevone/images'
+OUTPUT_PATH = './onevone/static/images'
+DDRAGON_URL = 'http://ddragon.leagueoflegends.com/cdn'
+
+
+def version_key(patch_version):
+    return tuple(int(part) for part in re.findall(r'\d+', patch_version))
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def webp_supported():
+    """
+    Whether Pillow was built with WebP. Without it only the PNG and JPEG
+    variants are written, and nothing may point at the WebP ones
+    """
+    from PIL import Image
+    Image.init()
+    return 'WEBP' in Image.SAVE
+
+
+def sheet_digest(paths):
+    digest = hashlib.sha1('{0}x{1}:{2}:{3}'.format(
+        IMAGES_PER_LINE, IMAGE_SIZE, WEBP_QUALITY,
+        webp_supported()).encode('utf-8'))
+    for path in paths:
+        digest.update(b'\0')
+        if path is not None:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def save_image(image, path, format, **params):
+    """
+    Saves through a temporary file so a page being served never sees a
+    half written image
+    """
+    with atomic_write(path) as f:
+        image.save(f, format=format, **params)
+
+
+def save_variants(image, prefix):
+    """
+    Writes image as an optimized PNG, quantized to a palette unless it is
+    greyscale, and as WebP where Pillow was built with it
+    """
+    png = image if image.mode == 'L' else image.quantize(colors=256)
+    save_image(png, prefix + '.png', 'PNG', optimize=True)
+    if webp_supported():
+        save_image(image, prefix + '.webp', 'WEBP', quality=WEBP_QUALITY,
+                   method=6)
+
+
+def build_sheet(paths, prefix):
+    """
+    Decodes, resizes and pastes the images of one sheet and writes its
+    variants. Runs in a worker process
+    """
+    from PIL import Image
+    Image.init()
+    width = IMAGES_PER_LINE * IMAGE_SIZE
+    height = (int(len(paths) / IMAGES_PER_LINE) + 1) * IMAGE_SIZE
+    sheet = Image.new('RGB', (width, height))
+    for slot, path in enumerate(paths):
+        if path is None:
+            continue
+        image = Image.open(path).resize((IMAGE_SIZE, IMAGE_SIZE))
+        sheet.paste(image, ((slot % IMAGES_PER_LINE) * IMAGE_SIZE,
+                            int(slot / IMAGES_PER_LINE) * IMAGE_SIZE))
+    save_variants(sheet, prefix)
+    save_variants(sheet.resize((int(width * 0.5), int(height * 0.5)),
+                               Image.LANCZOS), prefix + '.small')
+    save_variants(sheet.convert('L'), prefix + '_grey')
+    return prefix
+
+
+def splash_webp_path(target):
+    return os.path.splitext(target)[0] + '.webp'
+
+
+def build_splash(path, target):
+    """
+    Writes a splash scaled down to SPLASH_WIDTH as progressive JPEG at
+    target and as WebP next to it. Runs in a worker process
+    """
+    from PIL import Image
+    Image.init()
+    image = Image.open(path).convert('RGB')
+    if image.size[0] > SPLASH_WIDTH:
+        image = image.resize(
+            (SPLASH_WIDTH,
+             int(round(image.size[1] * SPLASH_WIDTH / image.size[0]))),
+            Image.LANCZOS)
+    save_image(image, target, 'JPEG', quality=SPLASH_JPEG_QUALITY,
+               optimize=True, progressive=True)
+    if webp_supported():
+        save_image(image, splash_webp_path(target), 'WEBP',
+                   quality=WEBP_QUALITY, method=6)
+    return target
+
+
+class SpriteBuilder(object):
+
+    """
+    api is the RESTClient used to download images. At most concurrency
+    downloads are in flight and at most processes sheets are built at
+    once
+    """
+
+    def __init__(self, api, log, store=STORE_PATH, output=OUTPUT_PATH,
+                 concurrency=16, processes=None, keep_patches=5):
+        self.api = api
+        self.log = log
+        self.store = store
+        self.output = output
+        self.concurrency = concurrency
+        self.processes = processes
+        self.keep_patches = keep_patches
+
+    def build(self, sheets):
+        """
+        sheets maps a model name to its entries, (id, patch_version,
+        image_blob, splash_blob) tuples ordered by id. Returns the sprite
+        offsets of every entry, as rendered into static_data.css
+        """
+        self.patches = self.stored_patches()
+        icons = {}
+        splashes = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for model_name, entries in sheets.items():
+                icons[model_name] = [executor.submit(
+                    self.fetch, '{0}/{1}/img/{2}/{3}'.format(
+                        DDRAGON_URL, patch_version, model_name, image_blob),
+                    patch_version, model_name, image_blob)
+                    for _, patch_version, image_blob, _ in entries]
+                category = '{0}-splash'.format(model_name)
+                splashes.extend((category, splash_blob, executor.submit(
+                    self.fetch, '{0}/img/{1}/loading/{2}'.format(
+                        DDRAGON_URL, model_name, splash_blob),
+                    patch_version, category, splash_blob))
+                    for _, patch_version, _, splash_blob in entries
+                    if splash_blob is not None)
+            icons = {model_name: [future.result() for future in futures]
+                     for model_name, futures in icons.items()}
+            splashes = [(category, splash_blob, future.result())
+                        for category, splash_blob, future in splashes]
+
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            built = []
+            for model_name, paths in icons.items():
+                prefix = os.path.join(self.output,
+                                      '{0}_sprite'.format(model_name))
+                digest = sheet_digest(paths)
+                if self.is_built(prefix, digest):
+                    self.log.debug('{0} sprite is up to date'.format(
+                        model_name))
+                    continue
+                built.append((executor.submit(build_sheet, paths, prefix),
+                              digest))
+            splash_manifest = self.load_splash_manifest()
+            built_splashes = []
+            for category, splash_blob, path in splashes:
+                if path is None:
+                    continue
+                target = os.path.join(self.output, category, splash_blob)
+                digest = file_digest(path)
+                if (splash_manifest.get(target) == digest and
+                        os.path.exists(target) and
+                        (not webp_supported() or
+                         os.path.exists(splash_webp_path(target)))):
+                    continue
+                built_splashes.append((executor.submit(
+                    build_splash, path, target), digest))
+            for future, digest in built:
+                prefix = future.result()
+                with open(prefix + '.manifest', 'w') as f:
+                    f.write(digest)
+                self.log.info('Built {0}'.format(prefix))
+            for future, digest in built_splashes:
+                splash_manifest[future.result()] = digest
+            if len(built_splashes) > 0:
+                self.log.info('Built {0} splashes'.format(
+                    len(built_splashes)))
+                self.write(self.splash_manifest_path(),
+                           json.dumps(splash_manifest).encode('utf-8'))
+
+        self.prune()
+        return {
+            model_name: [{
+                'id': entry[0],
+                'xoffset_small': -(slot % IMAGES_PER_LINE) * 32,
+                'yoffset_small': -int(slot / IMAGES_PER_LINE) * 32,
+                'xoffset_big': -(slot % IMAGES_PER_LINE) * 64,
+                'yoffset_big': -int(slot / IMAGES_PER_LINE) * 64,
+            } for slot, entry in enumerate(entries)]
+            for model_name, entries in sheets.items()
+        }
+
+    def is_built(self, prefix, digest):
+        extensions = ['.png']
+        if webp_supported():
+            extensions.append('.webp')
+        try:
+            with open(prefix + '.manifest', 'r') as f:
+                return (f.read() == digest and
+                        all(os.path.exists(prefix + variant + extension)
+                            for variant in ('', '.small', '_grey')
+                            for extension in extensions))
+        except OSError:
+            return False
+
+    def splash_manifest_path(self):
+        return os.path.join(self.output, 'splash.manifest')
+
+    def load_splash_manifest(self):
+        """
+        Digest of the source image of every splash written so far, by
+        output path
+        """
+        try:
+            with open(self.splash_manifest_path(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def fetch(self, url, patch_version, category, blob):
+        """
+        Path of the stored copy of an image, downloading it if needed.
+        Falls back to the copy of an older patch, or None, if it cannot be
+        downloaded
+        """
+        path = os.path.join(self.store, patch_version, category, blob)
+        if os.path.exists(path):
+            return path
+        previous = self.previous_copy(patch_version, category, blob)
+        try:
+            self.download(url, path, previous)
+        except Exception as e:
+            self.log.error('Could not fetch {0}: {1}'.format(url, repr(e)))
+            return previous
+        return path
+
+    def download(self, url, path, previous=None):
+        headers = {}
+        if previous is not None and os.path.exists(previous + '.etag'):
+            with open(previous + '.etag', 'r') as f:
+                headers['If-None-Match'] = f.read()
+        url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()[:6]
+        for attempt in range(self.api.max_attempts):
+            response = self.api.request(url, None, headers)
+            if response.status_code == 304:
+                self.link(previous, path)
+                self.link(previous + '.etag', path + '.etag')
+                return
+            delay = self.api.retry_delay(response.status_code,
+                                         response.headers, url_hash, attempt)
+            if delay is None:
+                self.write(path, response.content)
+                etag = response.headers.get('ETag')
+                if etag is not None:
+                    self.write(path + '.etag', etag.encode('utf-8'))
+                return
+            time.sleep(delay)
+        raise TooManyRetries('Giving up on {0} after {1} attempts'.format(
+            url, self.api.max_attempts))
+
+    def stored_patches(self):
+        try:
+            patches = os.listdir(self.store)
+        except OSError:
+            return []
+        return sorted(patches, key=version_key, reverse=True)
+
+    def previous_copy(self, patch_version, category, blob):
+        for stored_patch in self.patches:
+            if version_key(stored_patch) >= version_key(patch_version):
+                continue
+            path = os.path.join(self.store, stored_patch, category, blob)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def prune(self):
+        for stored_patch in self.stored_patches()[self.keep_patches:]:
+            shutil.rmtree(os.path.join(self.store, stored_patch),
+                          ignore_errors=True)
+
+    def link(self, source, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            return
+        try:
+            os.link(source, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(source, path)
+
+    def write(self, path, data):
+        with atomic_write(path) as f:
+            f.write(data)
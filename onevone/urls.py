@@ -26,6 +26,9 @@ register_api(SummonerSpellAPI,
              'summoners_api', '/summoners/', pk='id', pk_type='int')
 app.add_url_rule('/api/v0/matchup/<int:champion>/<int:enemy>',
                  view_func=MatchupAPI.as_view('matchup_api'), methods=['GET'])
+app.add_url_rule('/api/v0/cache/stats',
+                 view_func=CacheStatsAPI.as_view('cache_stats_api'),
+                 methods=['GET'])
 
 # Generic routes
 
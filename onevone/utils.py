@@ -1,47 +1,30 @@
 from onevone.db_manager import DBManager
 from onevone.models import *
 from onevone import errors
+from onevone import aggregation
+from onevone.cache import (cached, cached_hash, bump_generation,
+                           msgpack_codec)
+from onevone.sprites import SpriteBuilder, version_key, webp_supported
+from onevone.bundle import BUNDLE_PATH, StaticBundle, write_bundle
 
-from rest.restclient import RESTClient, ForbiddenException, NotFound
+from rest.restclient import (RESTClient, AsyncRESTClient, RateLimiter,
+                             ResponseCache, ForbiddenException, NotFound,
+                             TooManyRetries)
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import os
 import sys
 import requests
 import re
+import threading
 import time
 from datetime import datetime
 from onevone import log
-import redis
-from sqlalchemy.orm import load_only
-from sqlalchemy import exists
-from sqlalchemy.exc import IntegrityError
-
-cache = redis.from_url('redis://localhost:6379/0')
-
-
-class cached(object):
-
-    def __init__(self, timeout=-1, key_format='key'):
-        self.timeout = timeout
-        if not isinstance(key_format, str):
-            raise
-        self.key_format = key_format
-
-    def __call__(self, f):
-        def decorator(*args, **kwargs):
-            cache_key = self.key_format.format(*args, **kwargs)
-            ret = cache.get(cache_key)
-            if ret is None:
-                ret = f(*args, **kwargs)
-                if ret is not None:
-                    cache.set(cache_key, json.dumps(ret))
-                    if self.timeout > 0:
-                        cache.expire(cache_key, self.timeout)
-                return ret
-            return json.loads(ret.decode('utf-8'))
-        return decorator
+from sqlalchemy.orm import aliased
+from sqlalchemy import exists, text, tuple_
 
 DBManager.init(os.environ['ONEVONE_PRODUCTION_DB'])
 RIOT_GLOBAL_API = 'https://global.api.pvp.net/api/lol'
@@ -53,120 +36,221 @@ api_versions = {
     'match': 'v2.2',
 }
 
+# Written by the updater every time it checks for a new patch
+API_VERSION_FILE = '/var/tmp/onevone/api_version.json'
+
 xy_version_regex = r'^((?:\d+\.*){2})((?:\.\d*)*)$'
 xyz_version_regex = r'^((?:\d+\.*){3})((?:\.\d*)*)$'
 static_url = '{0}/static-data/eune/{1}'.format(RIOT_GLOBAL_API,
                                                api_versions['static'])
-riot_static_api = RESTClient(base_url=static_url, log=log)
-riot_api = RESTClient(log=log)
+# Every client using RIOT_API_KEY, in every thread, draws from these buckets
+riot_rate_limiter = RateLimiter(limits=[(10, 1), (500, 600)])
+# Static data requests for a given version never change, the rest are
+# revalidated once their TTL is over
+riot_static_cache = ResponseCache('/var/tmp/onevone/http-cache',
+                                  ttls={'/versions': 3600},
+                                  default_ttl=3600 * 24)
+riot_static_api = RESTClient(base_url=static_url, log=log,
+                             rate_limiter=riot_rate_limiter,
+                             cache=riot_static_cache)
+riot_api = RESTClient(log=log, rate_limiter=riot_rate_limiter)
+riot_async_api = AsyncRESTClient(log=log, concurrency=10,
+                                 rate_limiter=riot_rate_limiter)
+
+
+def stored_api_version():
+    """
+    Versions last recorded by the updater. Served on a cold cache while
+    the real ones are fetched in the background
+    """
+    try:
+        with open(API_VERSION_FILE, 'r') as f:
+            versions = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if len(versions.get('versions', [])) == 0:
+        return None
+    return versions
 
 
 class StaticDataContext(object):
 
+    STATIC_MODELS = [Champion, Item, Mastery, Rune, SummonerSpell]
+
     @classmethod
-    def populate_static_data(cls, patch_versions=None):
+    def populate_static_data(cls, patch_versions=None, concurrency=8):
+        """
+        Fetches and processes the static data of every model and patch
+        concurrently, then writes it patch by patch, oldest first. Rows a
+        newer patch already wrote are left alone, so repopulating only
+        writes what the latest patch changed
+        """
 
         if patch_versions is None:
             patch_versions = cls.get_api_version()['versions'][:5]
 
-        patch_versions.reverse()
-        for patch_version in patch_versions:
-            patch_version = re.sub(xyz_version_regex, r'\1',
-                                   patch_version)
-            cls.populate_champions(patch_version)
-            cls.populate_items(patch_version)
-            cls.populate_masteries(patch_version)
-            cls.populate_runes(patch_version)
-            cls.populate_summoners(patch_version)
-            cache.flushall()
+        patch_versions = [re.sub(xyz_version_regex, r'\1', patch_version)
+                          for patch_version in reversed(patch_versions)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            fetched = {
+                (patch_version, model): executor.submit(
+                    cls.fetch_static_table, model=model,
+                    *cls.static_table_request(model, patch_version))
+                for patch_version in patch_versions
+                for model in cls.STATIC_MODELS
+            }
+            for patch_version in patch_versions:
+                written = 0
+                for model in cls.STATIC_MODELS:
+                    rows = fetched[(patch_version, model)].result()
+                    if rows is not None:
+                        written += cls.write_static_table(model, rows,
+                                                          patch_version)
+                if written > 0:
+                    bump_generation()
+        try:
+            cls.get_mastery_tree_template.refresh(
+                re.sub(xy_version_regex, r'\1', patch_versions[-1]))
+        except TooManyRetries as e:
+            # Compiled on first use instead
+            log.error('Could not compile the mastery tree: {0}'.format(
+                repr(e)))
 
     @staticmethod
-    def populate_static_table(endpoint='', model=None, payload={}, version=None):
+    def static_table_request(model, version):
+        """
+        Endpoint and payload of a model's static data for a patch
+        """
+        tables = {
+            Champion: ('/champion', {
+                'locale': 'en_US',
+                'api_key': RIOT_API_KEY,
+                'champData': 'image,tags',
+                'version': version,
+            }),
+            Item: ('/item', {
+                'itemListData': 'image',
+                'api_key': RIOT_API_KEY,
+                'version': version,
+            }),
+            Mastery: ('/mastery', {
+                'masteryListData': 'all',
+                'api_key': RIOT_API_KEY,
+                'version': version,
+            }),
+            Rune: ('/rune', {
+                'runeListData': 'image',
+                'api_key': RIOT_API_KEY,
+                'version': version,
+            }),
+            SummonerSpell: ('/summoner-spell', {
+                'spellData': 'image',
+                'api_key': RIOT_API_KEY,
+                'version': version,
+            }),
+        }
+        return tables[model]
+
+    @classmethod
+    def populate_static_table(cls, model, version):
+        rows = cls.fetch_static_table(
+            *cls.static_table_request(model, version), model=model)
+        if rows is not None:
+            cls.write_static_table(model, rows, version)
+
+    @staticmethod
+    def fetch_static_table(endpoint, payload, model=None):
+        """
+        Fetches a model's static data and returns its processed rows along
+        with the hash of their content, None if it could not be fetched
+        """
         entity_name = model.__name__.lower()
-        log.debug('Populating {0} table'.format(model.__tablename__))
         try:
             results = riot_static_api.get(endpoint=endpoint, payload=payload)
-        except ForbiddenException:
-            return
-        results_length = len(results['data'].keys())
-        log.info('Fetched {0} {1}s'.format(results_length, entity_name))
+        except (ForbiddenException, TooManyRetries):
+            return None
+        log.info('Fetched {0} {1}s'.format(len(results['data']),
+                                           entity_name))
+        _process_ctx = getattr(
+            DataProcessContext,
+            'process_{0}_data'.format(entity_name)
+        )
+        if _process_ctx is None:
+            raise Exception(
+                'No data process function for model {0} was '
+                'defined'.format(entity_name))
+        columns = [column.name for column in model.__table__.columns
+                   if column.name not in ('patch_version', 'content_hash')]
+        rows = []
+        for entity_data in results['data'].values():
+            entity = model(**_process_ctx(entity_data))
+            row = {column: getattr(entity, column) for column in columns}
+            content_hash = hashlib.sha1(json.dumps(
+                row, sort_keys=True, default=str).encode('utf-8'))\
+                .hexdigest()
+            rows.append((row, content_hash))
+        return rows
+
+    @staticmethod
+    def write_static_table(model, rows, version):
+        """
+        Writes the rows whose content changed and moves the unchanged ones
+        to the given patch, skipping those stored for a newer one. Returns
+        how many rows were written or moved
+        """
+        entity_name = model.__name__.lower()
+        log.debug('Populating {0} table'.format(model.__tablename__))
         with DBManager.create_session_scope() as session:
-            status_cnt = 0
-            for entity_data in results['data'].values():
-                status_cnt += 1
-                print(
-                    '[*] Status {0}/{1}'.format(status_cnt, results_length),
-                    end='\r')
-                _process_ctx = getattr(
-                    DataProcessContext,
-                    'process_{0}_data'.format(entity_name)
-                )
-                if _process_ctx is None:
-                    raise Exception(
-                        'No data process function for model {0} was '
-                        'defined'.format(entity_name))
-                _processed_data = _process_ctx(entity_data)
-                session.merge(model(**dict(_processed_data, patch_version=version)))
-        log.debug('Done!')
+            stored = {entity_id: (content_hash, patch_version)
+                      for entity_id, content_hash, patch_version in
+                      session.query(model.id, model.content_hash,
+                                    model.patch_version)}
+            changed = []
+            unchanged = []
+            for row, content_hash in rows:
+                stored_hash, stored_version = stored.get(row['id'],
+                                                         (None, None))
+                if (stored_version is not None and
+                        version_key(stored_version) > version_key(version)):
+                    continue
+                if stored_hash != content_hash:
+                    changed.append(dict(row, patch_version=version,
+                                        content_hash=content_hash))
+                elif stored_version != version:
+                    unchanged.append(row['id'])
+            DBManager.bulk_upsert(session, model, changed)
+            if len(unchanged) > 0:
+                session.query(model).filter(model.id.in_(unchanged))\
+                    .update({'patch_version': version},
+                            synchronize_session=False)
+        log.debug('Done! {0} {1}s written, {2} moved to {3}'.format(
+            len(changed), entity_name, len(unchanged), version))
+        return len(changed) + len(unchanged)
 
     @classmethod
     def populate_champions(cls, version):
-        payload = {
-            'locale': 'en_US',
-            'api_key': RIOT_API_KEY,
-            'champData': 'image,tags',
-            'version': version,
-        }
-        endpoint = '/champion'
-        cls.populate_static_table(
-            endpoint=endpoint, model=Champion, payload=payload, version=version)
+        cls.populate_static_table(Champion, version)
 
     @classmethod
     def populate_items(cls, version):
-        payload = {
-            'itemListData': 'image',
-            'api_key': RIOT_API_KEY,
-            'version': version,
-        }
-        endpoint = '/item'
-        cls.populate_static_table(endpoint=endpoint, model=Item,
-                                  payload=payload, version=version)
+        cls.populate_static_table(Item, version)
 
     @classmethod
     def populate_masteries(cls, version):
-
-        payload = {
-            'masteryListData': 'all',
-            'api_key': RIOT_API_KEY,
-            'version': version,
-        }
-        endpoint = '/mastery'
-        cls.populate_static_table(
-            endpoint=endpoint, model=Mastery, payload=payload, version=version)
+        cls.populate_static_table(Mastery, version)
 
     @classmethod
     def populate_summoners(cls, version):
-        payload = {
-            'spellData': 'image',
-            'api_key': RIOT_API_KEY,
-        }
-        endpoint = '/summoner-spell'
-        cls.populate_static_table(
-            endpoint=endpoint, model=SummonerSpell, payload=payload, version=version)
+        cls.populate_static_table(SummonerSpell, version)
 
     @classmethod
     def populate_runes(cls, version):
-        payload = {
-            'runeListData': 'image',
-            'api_key': RIOT_API_KEY,
-            'version': version,
-        }
-        endpoint = '/rune'
-        cls.populate_static_table(endpoint=endpoint, model=Rune,
-                                  payload=payload, version=version)
+        cls.populate_static_table(Rune, version)
 
     @staticmethod
-    @cached(timeout=3600*24, key_format='api_version')
+    @cached(timeout=3600*24, key_format='api_version', local=True,
+            stale_while_revalidate=True, stale_timeout=3600*24*7,
+            default=stored_api_version)
     def get_api_version():
         payload = {
             'api_key': RIOT_API_KEY
@@ -176,18 +260,110 @@ class StaticDataContext(object):
             'versions': versions
         }
 
+    # Bundle of the latest patch mapped by this process, and when we last
+    # looked for one that was not there. A replaced bundle is closed once
+    # requests still reading it are done
+    bundle = None
+    bundle_missing_at = {}
+    bundle_lock = threading.Lock()
+    BUNDLE_RETRY = 60
+    BUNDLE_CLOSE_DELAY = 60
+
+    @classmethod
+    def static_bundle(cls):
+        """
+        The static data bundle of the latest patch, None until the updater
+        has written it
+        """
+        patch_version = re.sub(xy_version_regex, r'\1',
+                               cls.get_api_version()['versions'][0])
+        bundle = cls.bundle
+        if bundle is not None and bundle.patch_version == patch_version:
+            return bundle
+        with cls.bundle_lock:
+            # Another thread may have mapped it while we waited
+            bundle = cls.bundle
+            if bundle is not None and bundle.patch_version == patch_version:
+                return bundle
+            if time.time() - cls.bundle_missing_at.get(patch_version, 0) < \
+                    cls.BUNDLE_RETRY:
+                return None
+            try:
+                bundle = StaticBundle(BUNDLE_PATH.format(patch_version))
+            except (OSError, ValueError):
+                cls.bundle_missing_at[patch_version] = time.time()
+                return None
+            previous, cls.bundle = cls.bundle, bundle
+            if previous is not None:
+                timer = threading.Timer(cls.BUNDLE_CLOSE_DELAY,
+                                        previous.close)
+                timer.daemon = True
+                timer.start()
+            return bundle
+
+    @classmethod
+    def write_static_bundle(cls):
+        patch_version = re.sub(xy_version_regex, r'\1',
+                               cls.get_api_version()['versions'][0])
+        with DBManager.create_session_scope_nc() as session:
+            tables = {
+                model.__tablename__: [
+                    o.serialize()
+                    for o in session.query(model).order_by(model.id)]
+                for model in cls.STATIC_MODELS
+            }
+        write_bundle(BUNDLE_PATH.format(patch_version), patch_version,
+                     tables)
+        log.info('Wrote static data bundle of patch {0}'.format(
+            patch_version))
+
+    @classmethod
+    def get_objects_id_dict(cls, model):
+        bundle = cls.static_bundle()
+        if bundle is not None:
+            return bundle.all(model.__tablename__)
+        return cls.load_objects_id_dict(model)
+
     @staticmethod
-    @cached(key_format='{0}:id', timeout=3600)
-    def get_objects_id_dict(model):
+    @cached(key_format='{0}:id', timeout=3600, local=True,
+            namespaced=True, codec=msgpack_codec)
+    def load_objects_id_dict(model):
         with DBManager.create_session_scope(expire_on_commit=False) as session:
             ret = {str(o.id): o.serialize() for o in
                    session.query(model).all()}
             return ret
         return None
 
+    @classmethod
+    def get_objects_by_ids(cls, model, ids):
+        """
+        The serialized objects of model with the given ids, by id as a
+        string. Only those are read from the static bundle, or from the
+        model's Redis hash when there is none
+        """
+        bundle = cls.static_bundle()
+        if bundle is not None:
+            return bundle.get_many(model.__tablename__, ids)
+
+        def load():
+            with DBManager.create_session_scope(
+                    expire_on_commit=False) as session:
+                return {o.id: o.serialize()
+                        for o in session.query(model).all()}
+        return cached_hash('static:{0}'.format(model.__tablename__), ids,
+                           load, timeout=3600, codec=msgpack_codec)
+
+    @classmethod
+    def get_object_from_name(cls, model, name):
+        bundle = cls.static_bundle()
+        if bundle is not None:
+            return bundle.find(model.__tablename__, name)
+        return cls.load_object_from_name(model, name)
+
     @staticmethod
-    @cached(key_format='{0}:name:{1}', timeout=3600)
-    def get_object_from_name(model, name):
+    @cached(key_format='{0}:name:{1}', timeout=3600, local=True,
+            namespaced=True)
+    def load_object_from_name(model, name):
         with DBManager.create_session_scope(expire_on_commit=False) as session:
             ret = session.query(model).filter_by(name=name).first()
             if ret is not None:
@@ -195,123 +371,102 @@ class StaticDataContext(object):
             return ret
         return None
 
-    class MasteryTree(object):
-
-        __instance = None
-
-        def __new__(cls):
-            if cls.__instance is None:
-                cls.__instance = object.__new__(cls)
-                payload = {
-                    'masteryListData': 'all',
-                    'api_key': RIOT_API_KEY
-                }
-                endpoint = '/mastery'
-                data = riot_static_api.get(endpoint=endpoint, payload=payload)
-                cls.__instance.mastery_tree = data['tree']
-                cls.__instance.masteries = StaticDataContext.get_objects_id_dict(Mastery)
-            return cls.__instance
+    @staticmethod
+    def full_version(patch_version):
+        """
+        Newest known x.y.z version of the x.y patch_version, the latest
+        version if patch_version is not one of them
+        """
+        versions = StaticDataContext.get_api_version()['versions']
+        for version in versions:
+            if re.sub(xy_version_regex, r'\1', version) == patch_version:
+                return version
+        return versions[0]
 
-    @classmethod
-    def generate_mastery_tree(cls, masteries_list):
-        ret = []
-        masteries_list = {m: int(p) for m, p in map(lambda x: x.split(':'),
-                                                    masteries_list)}
-        mt = cls.MasteryTree()
-        branch_order = ['Ferocity', 'Cunning', 'Resolve']
-        for branch in branch_order:
-            branch_data = []
-            for level in mt.mastery_tree[branch]:
-                level_masteries = []
+    @staticmethod
+    @cached(key_format='mastery_tree:{0}', timeout=3600*24*7, local=True,
+            namespaced=True, codec=msgpack_codec)
+    def get_mastery_tree_template(patch_version):
+        """
+        The mastery tree of a patch compiled for generate_mastery_tree: the
+        levels of every branch as lists of slots, the mastery in each slot
+        and the slot of each mastery id
+        """
+        payload = {
+            'masteryListData': 'all',
+            'api_key': RIOT_API_KEY,
+            'version': StaticDataContext.full_version(patch_version),
+        }
+        tree = riot_static_api.get(endpoint='/mastery',
+                                   payload=payload)['tree']
+        masteries = StaticDataContext.get_objects_id_dict(Mastery)
+        template = {'branches': [], 'masteries': [], 'slots': {}}
+        for branch in ['Ferocity', 'Cunning', 'Resolve']:
+            levels = []
+            for level in tree[branch]:
+                level_slots = []
                 for mastery in level['masteryTreeItems']:
                     if mastery is None:
-                        level_masteries.append(None)
-                    else:
-                        mid = str(mastery["masteryId"])
-                        if masteries_list.get(mid) is None:
-                            points = 0
-                        else:
-                            points = masteries_list[mid]
-                        mastery_dict = mt.masteries[mid]
-                        mastery_dict['points'] = points
-                        level_masteries.append(mastery_dict)
-                branch_data.append(level_masteries)
-            ret.append({'name': branch, 'data': branch_data})
-        return ret
+                        level_slots.append(None)
+                        continue
+                    mid = str(mastery['masteryId'])
+                    slot = len(template['masteries'])
+                    template['slots'][mid] = slot
+                    template['masteries'].append(masteries[mid])
+                    level_slots.append(slot)
+                levels.append(level_slots)
+            template['branches'].append({'name': branch, 'levels': levels})
+        return template
+
+    @classmethod
+    def generate_mastery_tree(cls, masteries_list, patch_version=None):
+        if patch_version is None:
+            patch_version = re.sub(xy_version_regex, r'\1',
+                                   cls.get_api_version()['versions'][0])
+        template = cls.get_mastery_tree_template(patch_version)
+        points = {}
+        for mastery in masteries_list:
+            mid, mastery_points = mastery.split(':')
+            slot = template['slots'].get(mid)
+            if slot is not None:
+                points[slot] = int(mastery_points)
+        # The template is shared, every slot gets a dict of its own
+        masteries = template['masteries']
+        return [{
+            'name': branch['name'],
+            'data': [[None if slot is None else
+                      dict(masteries[slot], points=points.get(slot, 0))
+                      for slot in level_slots]
+                     for level_slots in branch['levels']],
+        } for branch in template['branches']]
 
     @classmethod
     def generate_static_images(cls):
-        IMAGES_PER_LINE = 10
-        IMAGE_SIZE = 64
-        data = {}
+        sheets = {}
         with DBManager.create_session_scope() as session:
-            version = cls.get_api_version()['versions'][0]
-            ddragon_api = RESTClient(base_url='http://ddragon.'
-                                              'leagueoflegends.com/cdn',
-                                     log=log)
-
-            from PIL import Image
-            import io
             models = [SummonerSpell, Champion, Mastery, Item, Rune]
             for model in models:
                 if model == SummonerSpell:
                     model_name = 'spell'
                 else:
                     model_name = model.__name__.lower()
-
-                query_set = session.query(model)\
-                                   .order_by('id')\
-                                   .all()
-                CONCAT_WIDTH = IMAGES_PER_LINE * IMAGE_SIZE
-                CONCAT_HEIGHT = (int(len(query_set) / IMAGES_PER_LINE) + 1) * IMAGE_SIZE
-                sprite_img = Image.new('RGB', (CONCAT_WIDTH, CONCAT_HEIGHT))
-                data[model_name] = []
-                i, j = 0, 0
-                for entry in query_set:
-                    data[model_name].append({
-                        'id': entry.id,
-                        'xoffset_small': -j*32,
-                        'yoffset_small': -i*32,
-                        'xoffset_big': -j*64,
-                        'yoffset_big': -i*64,
-                    })
-                    endpoint = '/{0}/img/{1}/{2}'.format(entry.patch_version, 
-                                                         model_name, entry.image_blob)
-                    try:
-                        image_stream = ddragon_api.get(endpoint=endpoint,
-                                                       response_type='byte-stream')
-                    except Exception:
-                        continue
-                    image = Image.open(image_stream).resize((IMAGE_SIZE, IMAGE_SIZE))
-                    sprite_img.paste(image, (j*IMAGE_SIZE, i*IMAGE_SIZE))
-                    j += 1
-                    if j == IMAGES_PER_LINE:
-                        i += 1
-                        j = 0
-                    splash_blob = getattr(entry, 'splash_blob', None)
-                    if splash_blob is not None:
-                        endpoint = '/{0}/loading/{1}'.format(model_name, splash_blob)
-                        try:
-                            image_stream = ddragon_api.get(url='http://ddragon.leagueoflegends.com/cdn/img'.format(model_name, splash_blob),
-                                                           endpoint=endpoint,
-                                                           response_type='byte-stream')
-                        except Exception:
-                            continue
-                        image = Image.open(image_stream)
-                        image.save('./onevone/static/images/'+ model_name + '-splash/' + splash_blob)
-
-                sprite_img.save('./onevone/static/images/'+ model_name + '_sprite.png')
-                sprite_img_s = sprite_img.copy().resize((int(CONCAT_WIDTH*0.5), int(CONCAT_HEIGHT*0.5)))
-                sprite_img_s.save('./onevone/static/images/'+ model_name + '_sprite.small.png')
-                sprite_grey = sprite_img.copy().convert('L')
-                sprite_grey.save('./onevone/static/images/'+ model_name + '_sprite_grey.png')
+                sheets[model_name] = [
+                    (entry.id, entry.patch_version, entry.image_blob,
+                     getattr(entry, 'splash_blob', None))
+                    for entry in session.query(model).order_by('id').all()
+                ]
+        ddragon_api = RESTClient(base_url='http://ddragon.'
+                                          'leagueoflegends.com/cdn',
+                                 log=log)
+        data = SpriteBuilder(ddragon_api, log).build(sheets)
 
         from jinja2 import Environment
         with open('./onevone/static/css/static_data.template.css', 'r') as t,\
                 open('./onevone/static/css/static_data.css', 'w+') as f:
             template = t.read()
             f.write(Environment(trim_blocks=True, lstrip_blocks=True).
-                    from_string(template).render(data=data))
+                    from_string(template).render(data=data,
+                                                 webp=webp_supported()))
 
 
 class DataProcessContext(object):
@@ -364,6 +519,55 @@ class DataProcessContext(object):
         }
 
 
+class MatchupWriter(object):
+
+    """
+    Collects the matchups of many matches and writes them, their item and
+    spell timelines and the matches' CheckedMatch rows with a handful of
+    multi-row INSERTs and a single commit per flush.
+    """
+
+    def __init__(self):
+        self.matchups = []
+        self.checked_matches = []
+        self.pending_matches = 0
+
+    def add_match(self, data, checked_match=None):
+        self.matchups.extend(MatchContext.extract_matchups(data))
+        if checked_match is not None:
+            self.checked_matches.append(checked_match)
+        self.pending_matches += 1
+
+    def flush(self):
+        if self.pending_matches == 0:
+            return
+        with DBManager.create_session_scope() as session:
+            # Matchup ids are taken from the sequence up front so that the
+            # timelines can point at them within the same batch
+            ids = [i for i, in session.execute(text(
+                'SELECT nextval(\'tb_matchups_id_seq\') '
+                'FROM generate_series(1, :n)'), {'n': len(self.matchups)})]
+            matchups, item_timelines, spell_timelines = [], [], []
+            for matchup_id, (matchup_data, items, spells) in zip(
+                    ids, self.matchups):
+                matchups.append(dict(matchup_data, id=matchup_id,
+                                     checked=False))
+                item_timelines.append({'matchup_id': matchup_id,
+                                       'item_timeline': items})
+                spell_timelines.append({'matchup_id': matchup_id,
+                                        'spell_timeline': spells})
+            DBManager.bulk_insert(session, Matchup, matchups)
+            DBManager.bulk_insert(session, ItemTimeline, item_timelines)
+            DBManager.bulk_insert(session, SpellTimeLine, spell_timelines)
+            DBManager.bulk_upsert(session, CheckedMatch, self.checked_matches,
+                                  update=False)
+        log.debug('Stored {0} matchups of {1} matches'.format(
+            len(matchups), self.pending_matches))
+        self.matchups = []
+        self.checked_matches = []
+        self.pending_matches = 0
+
+
 class MatchContext(object):
 
     @staticmethod
@@ -380,7 +584,7 @@ class MatchContext(object):
         endpoint = '/{0}/league/{1}'.format(api_versions['league'], league)
         try:
             ladder = riot_api.get(url=url, endpoint=endpoint, payload=payload)
-        except ForbiddenException:
+        except (ForbiddenException, TooManyRetries):
             return
 
         if len(ladder.keys()) == 0:
@@ -393,15 +597,18 @@ class MatchContext(object):
         results_length = len(players)
 
         log.debug('[+] Fetched {0} players'.format(results_length))
+        # ON CONFLICT DO UPDATE may only touch a row once per statement
+        player_data = {}
+        for player in players:
+            player_data[player.get('playerOrTeamId')] = {
+                'id': player.get('playerOrTeamId'),
+                'region': region.lower(),
+                'tier': league.lower(),
+                'name': player.get('playerOrTeamName')
+            }
         with DBManager.create_session_scope() as session:
-            for player in players:
-                player_data = {
-                    'id': player.get('playerOrTeamId'),
-                    'region': region.lower(),
-                    'tier': league.lower(),
-                    'name': player.get('playerOrTeamName')
-                }
-                session.merge(ProPlayer(player_data))
+            DBManager.bulk_upsert(session, ProPlayer,
+                                  list(player_data.values()))
         log.debug('[+] Done!')
 
     @staticmethod
@@ -438,55 +645,89 @@ class MatchContext(object):
                     continue
                 except NotFound:
                     continue
-                for match in result.get("matches", []):
-                    match_data = {
-                        'id': match.get('matchId'),
-                        'region': match.get('region'),
-                        'match_timestamp': match.get('timestamp'),
-                        'added_at': datetime.now()
-                    }
-                    session.merge(QueuedMatch(match_data))
-                    session.commit()
+                except TooManyRetries:
+                    continue
+                added_at = datetime.now()
+                match_data = [{
+                    'id': match.get('matchId'),
+                    'region': match.get('region'),
+                    'match_timestamp': match.get('timestamp'),
+                    'added_at': added_at
+                } for match in result.get("matches", [])]
+                DBManager.bulk_upsert(session, QueuedMatch, match_data,
+                                      update=False)
+                session.commit()
 
     @classmethod
-    def populate_matchups(cls, limit=50, region='EUNE'):
+    def populate_matchups(cls, limit=50, region='EUNE', batch_size=25):
         session = DBManager.create_session(expire_on_commit=False)
         matches = session.query(QueuedMatch).filter_by(region=region).filter(
             ~exists().where(QueuedMatch.id == CheckedMatch.id))\
             .limit(limit).all()
-        for match in matches:
-            payload = {
-                'api_key': RIOT_API_KEY,
-                'includeTimeline': 'true',
-            }
-            log.debug('Fetching info for match {0}'.format(match.id))
-            url = 'https://{0}.api.pvp.net/api/lol/{0}'.format(region.lower())
-            endpoint = '/{0}/match/{1}'.format(api_versions['match'], match.id)
-            try:
-                result = riot_api.get(url=url, endpoint=endpoint, payload=payload)
-            except ForbiddenException:
-                continue
-            except NotFound:
-                continue
-            cls.populate_single_matchup(result)
-            checked_match = CheckedMatch({
+        payload = {
+            'api_key': RIOT_API_KEY,
+            'includeTimeline': 'true',
+        }
+        url = 'https://{0}.api.pvp.net/api/lol/{0}'.format(region.lower())
+        match_requests = [
+            (match, url,
+             '/{0}/match/{1}'.format(api_versions['match'], match.id),
+             payload)
+            for match in matches]
+
+        writer = MatchupWriter()
+        # Full batches are written from a thread of their own, in order, so
+        # that the event loop keeps fetching while the database works
+        db_writer = ThreadPoolExecutor(max_workers=1)
+        flushes = []
+
+        def match_fetched(match, result, error):
+            nonlocal writer
+            if error is not None:
+                if not isinstance(error, (ForbiddenException, NotFound)):
+                    log.error('Could not fetch match {0}: {1!r}'.format(
+                        match.id, error))
+                return
+            writer.add_match(result, checked_match={
                 'id': match.id,
                 'region': match.region,
                 'checked_at': datetime.now(),
                 'match_timestamp': match.match_timestamp
             })
-            session.merge(checked_match)
-            session.commit()
+            if writer.pending_matches >= batch_size:
+                flushes.append(db_writer.submit(writer.flush))
+                writer = MatchupWriter()
+
+        log.debug('Fetching info for {0} matches'.format(len(matches)))
+        try:
+            riot_async_api.fetch_all(match_requests, match_fetched)
+            flushes.append(db_writer.submit(writer.flush))
+            for flush in flushes:
+                flush.result()
+        finally:
+            db_writer.shutdown()
+            session.close()
 
     @staticmethod
-    # TODO: Clean Up this ugliness
     def populate_single_matchup(data):
+        writer = MatchupWriter()
+        writer.add_match(data)
+        writer.flush()
 
+    @staticmethod
+    # TODO: Clean Up this ugliness
+    def extract_matchups(data):
+        """
+        Returns a (matchup_data, item_timeline, spell_timeline) tuple for
+        every participant of the match that had a lane opponent
+        """
+
+        ret = []
         try:
             frames = data['timeline']['frames']
         except KeyError:
             log.error('No timeline data')
-            return
+            return ret
 
         item_timelines = defaultdict(list)
         spell_timelines = defaultdict(list)
@@ -524,193 +765,199 @@ class MatchContext(object):
             if participant['teamId'] == winning_team:
                 results[lane_role]['won'] = participant['championId']
 
-        with DBManager.create_session_scope(expire_on_commit=False) as session:
-            for lane_role, result in results.items():
+        for lane_role, result in results.items():
 
-                # Sometimes there are no matchups
-                if len(result['vs']) != 2:
-                    continue
+            # Sometimes there are no matchups
+            if len(result['vs']) != 2:
+                continue
 
-                for idx, participant in enumerate(result['vs']):
-                    pid = participant['participantId']
-                    enemy = result['vs'][(idx + 1) % 2]
-                    try:
-                        masteries = [
-                            '{0}:{1}'.format(m['masteryId'], m['rank'])
-                            for m in participant['masteries']
-                        ]
-
-                        runes = [
-                            '{0}:{1}'.format(r['runeId'], r['rank'])
-                            for r in participant['runes']
-                        ]
-
-                        summoners = '{0},{1}'.format(
-                            participant['spell1Id'],
-                            participant['spell2Id']
-                        )
-
-                        stats = participant.get('stats')
+            for idx, participant in enumerate(result['vs']):
+                pid = participant['participantId']
+                enemy = result['vs'][(idx + 1) % 2]
+                try:
+                    masteries = [
+                        '{0}:{1}'.format(m['masteryId'], m['rank'])
+                        for m in participant['masteries']
+                    ]
+
+                    runes = [
+                        '{0}:{1}'.format(r['runeId'], r['rank'])
+                        for r in participant['runes']
+                    ]
+
+                    summoners = '{0},{1}'.format(
+                        participant['spell1Id'],
+                        participant['spell2Id']
+                    )
+
+                    stats = participant.get('stats')
     
-                        matchup_data = {
-                            'champion': participant['championId'],
-                            'enemy': enemy['championId'],
-                            'won': participant['championId'] == result['won'],
-                            'kills': stats.get('kills'),
-                            'deaths': stats.get('deaths'),
-                            'assists': stats.get('assists'),
-                            'creep_score': stats.get('minionsKilled'),
-                            'damage_dealt':
-                                stats.get('totalDamageDealtToChampions'),
-                            'duration': data.get('matchDuration'),
-                            'patch_version':
-                                '.'.join(data.get('matchVersion').
-                                         split('.')[:2]),
-                            'masteries': masteries,
-                            'runes': runes,
-                            'summoners': summoners,
-                        }
-                    except KeyError:
-                        continue
-
-                    matchup = Matchup(matchup_data)
-                    session.add(matchup)
-                    session.flush()
-                    session.refresh(matchup)
-                    item_timeline_data = {
-                        'matchup_id': matchup.id,
-                        'item_timeline': item_timelines[pid]
+                    matchup_data = {
+                        'champion': participant['championId'],
+                        'enemy': enemy['championId'],
+                        'won': participant['championId'] == result['won'],
+                        'kills': stats.get('kills'),
+                        'deaths': stats.get('deaths'),
+                        'assists': stats.get('assists'),
+                        'creep_score': stats.get('minionsKilled'),
+                        'damage_dealt':
+                            stats.get('totalDamageDealtToChampions'),
+                        'duration': data.get('matchDuration'),
+                        'patch_version':
+                            '.'.join(data.get('matchVersion').
+                                     split('.')[:2]),
+                        'masteries': masteries,
+                        'runes': runes,
+                        'summoners': summoners,
                     }
-                    item_timeline = ItemTimeline(item_timeline_data)
-                    spell_timeline_data = {
-                        'matchup_id': matchup.id,
-                        'spell_timeline': spell_timelines[pid]
-                    }
-                    spell_timeline = SpellTimeLine(spell_timeline_data)
-                    session.add(item_timeline)
-                    session.add(spell_timeline)
-                    session.commit()
+                except KeyError:
+                    continue
+
+                ret.append((matchup_data, item_timelines[pid],
+                            spell_timelines[pid]))
+        return ret
 
     @classmethod
     def populate_averages(cls):
+        """
+        Folds the matchups ingested since the last run into the stored
+        statistics of every pair, recomputes the averages of the pairs that
+        changed and marks those matchups as checked
+        """
         with DBManager.create_session_scope(expire_on_commit=False) as session:
-            champions = [c.id for c in session.query(Champion).options(
-                load_only('id')).order_by('id').all()]
-            total_champs = len(champions)
-            versions = StaticDataContext.get_api_version()['versions'][:2]
-            for version in versions:
-                # Keep only the 2 majon numbers of the patch version
-                patch_version = re.sub(r'^((?:\d+\.*){2})((?:\.\d*)*)$', r'\1',
-                                       version)
+            # Every query below, down to the UPDATE marking matchups as
+            # checked, sees the same snapshot. Matchups committed while we
+            # aggregate, whatever ids they were given, are left unchecked
+            # for the next run
+            session.connection(
+                execution_options={'isolation_level': 'REPEATABLE READ'})
+            patch_versions = [p for p, in cls.unchecked_matchups(
+                session, Matchup.patch_version).distinct()]
+            if len(patch_versions) == 0:
+                return
+            started = time.time()
+            statistics = cls.matchup_statistics(session, patch_versions)
+            log.info('Computed statistics of {0} matchups in {1:.2f}s'.format(
+                len(statistics), time.time() - started))
+            for patch_version in patch_versions:
                 log.debug('Calculating Averages for patch : {0}'
                           .format(patch_version))
-                for i in range(0, total_champs):
-                    print('Status {0}/{1}'.format(i, total_champs), end='\r')
-                    for j in range(0, total_champs):
-                        if i == j:
-                            continue
-                        idA = champions[i]
-                        idB = champions[j]
-                        matchups = session.query(Matchup, SpellTimeLine, ItemTimeline)\
-                            .join(SpellTimeLine,
-                                  (Matchup.id == SpellTimeLine.matchup_id)) \
-                            .join(ItemTimeline,
-                                  (Matchup.id == ItemTimeline.matchup_id)) \
-                            .filter(
-                            (Matchup.champion == idA) & (Matchup.enemy == idB) &
-                            (Matchup.checked == False) & (Matchup.patch_version == patch_version)
-                        ).all()
-                        
-                        total_games = len(matchups)
-                        if total_games == 0:
-                            continue
-                        
-                        matchups, spell_timelines, item_timelines = zip(*matchups)
-
-                        kills = 0
-                        deaths = 0
-                        assists = 0
-                        damage_dealt = 0
-                        wins = 0
-                        creep_score = 0
-                        duration = 0
-                        for matchup in matchups:
-                            if matchup.won:
-                                wins += 1
-                            kills += matchup.kills
-                            deaths += matchup.deaths
-                            assists += matchup.assists
-                            damage_dealt += matchup.damage_dealt
-                            creep_score += matchup.creep_score
-                            duration += matchup.duration
-
-                        sts = [st.spell_timeline for st in spell_timelines]
-                        avg_spells = cls.timelines_average(data=sts)
-
-                        its = [it.item_timeline for it in item_timelines]
-                        avg_items = cls.timelines_average(data=its)
-
-                        mus = [(mu.masteries, mu.runes, mu.summoners)
-                               for mu in matchups]
-                        masteries, runes, summoners = zip(*mus)
-                        avg_masteries = cls.timelines_average(masteries)
-                        avg_runes = cls.timelines_average(runes)
-
-                        summoners = [sorted(s.split(',')) for s in summoners]
-                        avg_summoners = cls.timelines_average(summoners)
-
-                        matchup_avgs = {
-                            'champion': idA,
-                            'enemy': idB,
-                            'total_games': total_games,
-                            'kills': float(kills/total_games),
-                            'deaths': float(deaths/total_games),
-                            'assists': float(assists/total_games),
-                            'creep_score': float(creep_score/total_games),
-                            'damage_dealt': float(damage_dealt/total_games),
-                            'duration': float(duration/total_games),
-                            'wins': wins,
-                            'item_timeline': avg_items,
-                            'spell_timeline': avg_spells,
-                            'masteries': avg_masteries,
-                            'runes': avg_runes,
-                            'summoners': avg_summoners,
-                            'patch_version': patch_version
-                        }
-                        try:
-                            matchup_avgs = MatchupAverages(matchup_avgs)
-                            session.merge(matchup_avgs)
-                            session.commit()
-                        except IntegrityError:
-                            session.rollback()
-                            log.warn('Average already {0}vs{1} patch {2}'
-                                     'exists. Updating'.format(
-                                        idA, idB, patch_version))
-                            prev_matchup = session.query(
-                                MatchupAverages).filter_by(
-                                champion=idA, enemy=idB,
-                                patch_version=patch_version).first()
-
-                            session.merge(matchup_avgs)
-                            session.commit()
+                started = time.time()
+                matchup_stats = cls.fold_statistics(
+                    session, patch_version, statistics)
+                matchup_avgs = [
+                    dict(aggregation.averages(stats),
+                         champion=stats['champion'], enemy=stats['enemy'],
+                         patch_version=patch_version)
+                    for stats in matchup_stats]
+                for matchup_avg in matchup_avgs:
+                    matchup_avg['render_payload'] = cls.render_payload(
+                        matchup_avg)
+                aggregated = time.time()
+                DBManager.bulk_upsert(session, MatchupStatistics,
+                                      matchup_stats)
+                DBManager.bulk_upsert(session, MatchupAverages, matchup_avgs)
+                session.query(Matchup).filter(
+                    (Matchup.checked == False) &
+                    (Matchup.patch_version == patch_version)
+                ).update({'checked': True}, synchronize_session=False)
+                log.info('Patch {0}: {1} matchup averages aggregated in '
+                         '{2:.2f}s and written in {3:.2f}s'.format(
+                            patch_version, len(matchup_avgs),
+                            aggregated - started, time.time() - aggregated))
+
+    @staticmethod
+    def unchecked_matchups(session, *columns):
+        return session.query(*columns)\
+            .join(SpellTimeLine, (Matchup.id == SpellTimeLine.matchup_id))\
+            .join(ItemTimeline, (Matchup.id == ItemTimeline.matchup_id))\
+            .filter(Matchup.checked == False)
+
+    @classmethod
+    def matchup_statistics(cls, session, patch_versions):
+        """
+        Loads the numeric columns of the unchecked matchups of all the
+        given patches and reduces them per (champion, enemy, patch_version)
+        """
+        rows = cls.unchecked_matchups(
+            session, Matchup.champion, Matchup.enemy, Matchup.patch_version,
+            Matchup.won, Matchup.kills, Matchup.deaths, Matchup.assists,
+            Matchup.damage_dealt, Matchup.creep_score, Matchup.duration)\
+            .filter(Matchup.patch_version.in_(patch_versions)).all()
+        return aggregation.matchup_statistics(rows)
+
+    @classmethod
+    def fold_statistics(cls, session, patch_version, statistics):
+        """
+        Reads the build paths of a patch's unchecked matchups in a single
+        ordered scan and merges them, along with the numeric statistics,
+        into what is stored for each pair
+        """
+        rows = cls.unchecked_matchups(
+            session, Matchup.champion, Matchup.enemy, Matchup.masteries,
+            Matchup.runes, Matchup.summoners, SpellTimeLine.spell_timeline,
+            ItemTimeline.item_timeline)\
+            .filter(Matchup.patch_version == patch_version)\
+            .order_by(Matchup.champion, Matchup.enemy)\
+            .yield_per(1000)
+        new_stats = {}
+        for (champion, enemy), group in aggregation.group_matchups(rows):
+            new_stats[(champion, enemy)] = dict(
+                statistics[(champion, enemy, patch_version)],
+                champion=champion, enemy=enemy, patch_version=patch_version,
+                **aggregation.path_statistics(group))
+
+        pairs = list(new_stats.keys())
+        stored_stats = {}
+        for start in range(0, len(pairs), 1000):
+            for stats in session.query(MatchupStatistics).filter(
+                    (MatchupStatistics.patch_version == patch_version) &
+                    tuple_(MatchupStatistics.champion,
+                           MatchupStatistics.enemy).in_(
+                        pairs[start:start + 1000])):
+                stored_stats[(stats.champion, stats.enemy)] = \
+                    stats.serialize()
+        return [aggregation.merge_statistics(stored_stats.get(pair), stats)
+                for pair, stats in new_stats.items()]
+
+    @staticmethod
+    def rolling_averages(champion, enemy, patch_versions):
+        """
+        Averages of a pair over several patches, e.g. the last three,
+        merged from the stored statistics of each patch
+        """
+        with DBManager.create_session_scope_nc() as session:
+            merged = None
+            for stats in session.query(MatchupStatistics).filter(
+                    (MatchupStatistics.champion == champion) &
+                    (MatchupStatistics.enemy == enemy) &
+                    (MatchupStatistics.patch_version.in_(patch_versions))):
+                merged = aggregation.merge_statistics(merged,
+                                                      stats.serialize())
+            if merged is None:
+                return None
+            return dict(aggregation.averages(merged), champion=champion,
+                        enemy=enemy, patch_versions=patch_versions)
 
     @staticmethod
     def timelines_average(data=[]):
-        ret = []
-        bag = list(filter(lambda x: len(x) > 0, data))
-        idx = 0
-        data_keys = ({k: None for entry in data for k in entry}).keys()
-        while len(bag) > 0:
-            freq_table = {k: 0 for k in data_keys}
-            for entry in bag:
-                val = entry[idx]
-                freq_table[val] += 1
-            max_s = max(freq_table, key=freq_table.get)
-            ret.append(max_s)
-            bag = list(filter(lambda x: x[idx] == max_s, bag))
-            bag = list(filter(lambda x: len(x) > idx + 1, bag))
-            idx += 1
-        return ret
+        trie = aggregation.PathTrie()
+        trie.extend(data)
+        return trie.most_common_path()
+
+    @classmethod
+    def render_payload(cls, matchup_avg):
+        """
+        process_matchup of the averages in matchup_avg, None if they refer
+        to static data we do not have or that could not be fetched
+        """
+        try:
+            return cls.process_matchup(MatchupAverages(matchup_avg))
+        except (KeyError, ZeroDivisionError, ForbiddenException, NotFound,
+                TooManyRetries) as e:
+            log.error('Could not render matchup {0} vs {1}: {2}'.format(
+                matchup_avg['champion'], matchup_avg['enemy'], repr(e)))
+            return None
 
     @staticmethod
     def process_matchup(matchup):
@@ -730,17 +977,21 @@ class MatchContext(object):
         }
 
         # Process Masteries
-        masteries = StaticDataContext.generate_mastery_tree(matchup.masteries)
+        masteries = StaticDataContext.generate_mastery_tree(
+            matchup.masteries, matchup.patch_version)
 
-        runes_collection = StaticDataContext.get_objects_id_dict(Rune)
         runes = {(r, p) for r, p in map(lambda x: x.split(':'), matchup.runes)}
+        runes_collection = StaticDataContext.get_objects_by_ids(
+            Rune, {rid for rid, _ in runes})
         runes = [dict(runes_collection[rid], points=p) for rid, p in runes]
 
-        summoners_collection = StaticDataContext.get_objects_id_dict(SummonerSpell)
         summoners = matchup.summoners[1:-1].split(',')
+        summoners_collection = StaticDataContext.get_objects_by_ids(
+            SummonerSpell, summoners)
         summoners = [summoners_collection[s] for s in summoners]
 
-        items_collection = StaticDataContext.get_objects_id_dict(Item)
+        items_collection = StaticDataContext.get_objects_by_ids(
+            Item, set(matchup.item_timeline))
         # We need to make items list RLE
         items = []
         prev = None
@@ -792,7 +1043,8 @@ class MatchContext(object):
         }
 
     @staticmethod
-    @cached(key_format='matchup:{0}:{1}:{2}', timeout=60*60*24)
+    @cached(key_format='matchup:{0}:{1}:{2}', timeout=60*60*24,
+            single_flight=True, namespaced=True, codec=msgpack_codec)
     def get_matchup(champion_name, enemy_name, patch_version):
         champion = StaticDataContext.get_object_from_name(Champion, champion_name)
         enemy = StaticDataContext.get_object_from_name(Champion, enemy_name)
@@ -815,6 +1067,45 @@ class MatchContext(object):
             matchup_avg = matchup_avg.first()
             if matchup_avg is None:
                 raise errors.MatchupNotFound('Matchup not Found')
-            matchup_avg = matchup_avg
-            return dict(MatchContext.process_matchup(matchup_avg),
-                        champion=champion, enemy=enemy, versions=versions)
+            payload = matchup_avg.render_payload
+            if payload is None:
+                payload = MatchContext.process_matchup(matchup_avg)
+            return dict(payload, champion=champion, enemy=enemy,
+                        versions=versions)
+
+    @classmethod
+    def warm_matchups(cls, limit=None, concurrency=4):
+        """
+        Precomputes the cached get_matchup payload of the matchups of the
+        latest patch, most played first, so that their first visitors after
+        an aggregation do not pay for it
+        """
+        version = StaticDataContext.get_api_version()['versions'][0]
+        patch_version = re.sub(xy_version_regex, r'\1', version)
+        champion = aliased(Champion)
+        enemy = aliased(Champion)
+        with DBManager.create_session_scope_nc() as session:
+            pairs = session.query(champion.name, enemy.name)\
+                .join(MatchupAverages,
+                      MatchupAverages.champion == champion.id)\
+                .join(enemy, MatchupAverages.enemy == enemy.id)\
+                .filter(MatchupAverages.patch_version == patch_version)\
+                .order_by(MatchupAverages.total_games.desc())
+            if limit is not None:
+                pairs = pairs.limit(limit)
+            pairs = pairs.all()
+
+        def warm(pair):
+            try:
+                cls.get_matchup.refresh(pair[0], pair[1], None)
+                return True
+            except Exception as e:
+                log.error('Could not warm matchup {0} vs {1}: {2}'.format(
+                    pair[0], pair[1], repr(e)))
+                return False
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            warmed = sum(executor.map(warm, pairs))
+        log.info('Warmed {0}/{1} matchups of patch {2} in {3:.2f}s'.format(
+            warmed, len(pairs), patch_version, time.time() - started))
@@ -2,11 +2,17 @@ from onevone.app import app
 from onevone.models import *
 from onevone.db_manager import DBManager
 from onevone.utils import StaticDataContext, MatchContext
+from onevone.cache import cache_stats, current_generation
 from onevone import errors
 
+from collections import OrderedDict
 from functools import wraps
+import gzip
+import hashlib
 import json
+import os
 import redis
+import threading
 
 from flask import request, Response, jsonify, render_template, abort
 from flask.views import MethodView, View
@@ -26,10 +32,19 @@ __all__ = [
     'About',
     'Contact',
     'MatchupView',
+    'CacheStatsAPI',
 ]
 
 view_session = DBManager.create_session(expire_on_commit=False)
 
+# Static data does not change within a patch, matchup averages are
+# refreshed as new games are aggregated
+STATIC_MAX_AGE = 3600 * 24
+MATCHUP_MAX_AGE = 600
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BODY_CACHE_SIZE = 256
+
 
 def create_error_response(message, error_code):
     data = json.dumps({
@@ -42,16 +57,102 @@ def create_error_response(message, error_code):
     return response
 
 
-def create_success_response(payload):
-    data = json.dumps({
-        'data': payload,
-    })
-    response = Response(status=200,
-                        mimetype='application/json')
-    response.set_data(data)
+class ResponseBody(object):
+
+    """
+    A serialized success payload with its ETag. Bodies of at least
+    GZIP_MIN_SIZE bytes are compressed the first time a client accepts
+    gzip and the result is kept, so cached bodies are compressed once
+    """
+
+    def __init__(self, payload):
+        self.data = json.dumps({
+            'data': payload,
+        }).encode('utf-8')
+        self.etag = hashlib.sha1(self.data).hexdigest()
+        self.gzip_etag = self.etag + '-gzip'
+        self.compressible = len(self.data) >= GZIP_MIN_SIZE
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.data, GZIP_LEVEL)
+        return self._gzipped
+
+
+class BodyCache(object):
+
+    """
+    Bounded LRU of response bodies by cache generation and request. The
+    generation is bumped once the static data of a patch is written, so
+    every entry is dropped as soon as a newer one is seen
+    """
+
+    def __init__(self, size=BODY_CACHE_SIZE):
+        self.size = size
+        self.generation = None
+        self.bodies = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, generation, key):
+        with self.lock:
+            if generation != self.generation:
+                self.generation = generation
+                self.bodies.clear()
+                return None
+            body = self.bodies.get(key)
+            if body is not None:
+                self.bodies.move_to_end(key)
+            return body
+
+    def set(self, generation, key, body):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.bodies[key] = body
+            if len(self.bodies) > self.size:
+                self.bodies.popitem(last=False)
+
+
+body_cache = BodyCache()
+
+
+def create_success_response(payload=None, max_age=STATIC_MAX_AGE,
+                            body=None):
+    """
+    Answers with payload, or an already serialized body, honouring
+    If-None-Match and compressing large bodies for clients accepting gzip
+    """
+    if body is None:
+        body = ResponseBody(payload)
+    use_gzip = body.compressible and 'gzip' in request.accept_encodings
+    etag = body.gzip_etag if use_gzip else body.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(status=200,
+                            mimetype='application/json')
+        if use_gzip:
+            response.set_data(body.gzipped)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response.set_data(body.data)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if body.compressible:
+        response.vary.add('Accept-Encoding')
     return response
 
 
+def serialize(item):
+    # Static data comes from the bundle already serialized
+    if isinstance(item, dict):
+        return item
+    return item.serialize()
+
+
 def info_view(available_fields, default='id'):
     def pseudo_wrapper(wrapped_view):
         @wraps(wrapped_view)
@@ -63,13 +164,22 @@ def info_view(available_fields, default='id'):
                     return create_error_response('Unkown filter {0}'.format(field), 400)
                 else:
                     filter_fields[field] = value
+            # Not the latest patch version, which the updater records
+            # before it writes that patch's rows
+            generation = current_generation()
+            cache_key = (request.path, tuple(sorted(filter_fields.items())))
+            body = body_cache.get(generation, cache_key)
+            if body is not None:
+                return create_success_response(body=body)
             response = wrapped_view(filter_fields, *args, **kwargs)
 
             if response is not None:
                 if type(response) == list:
-                    return create_success_response([item.serialize() for item in response])
+                    body = ResponseBody([serialize(item) for item in response])
                 else:
-                    return create_success_response(response.serialize())
+                    body = ResponseBody(serialize(response))
+                body_cache.set(generation, cache_key, body)
+                return create_success_response(body=body)
             else:
                 return create_error_response('Not found', 404)
         return view_wrapper
@@ -111,6 +221,17 @@ class Contact(VersionedView):
     template = 'contact.html'
 
 
+def splash_webp(splash_blob):
+    """
+    URL of the WebP variant of a splash, None if it was not written
+    """
+    path = 'images/champion-splash/{0}.webp'.format(
+        splash_blob.rsplit('.', 1)[0])
+    if not os.path.exists(os.path.join(app.static_folder, path)):
+        return None
+    return '/static/' + path
+
+
 class MatchupView(VersionedView):
 
     def dispatch_request(self, champion, enemy):
@@ -126,6 +247,10 @@ class MatchupView(VersionedView):
         except errors.MatchupNotFound:
             abort(404)
         return render_template('matchup.html',
+                               champion_webp=splash_webp(
+                                   matchup['champion']['splash_blob']),
+                               enemy_webp=splash_webp(
+                                   matchup['enemy']['splash_blob']),
                                **dict(matchup, **self.get_arguments()))
 
 
@@ -142,6 +267,9 @@ class ModelAPI(MethodView):
 
     def get(self, filter, *args, **kwargs):
         pk_val = kwargs[self.pk_name]
+        bundle = StaticDataContext.static_bundle()
+        if bundle is not None:
+            return self.get_from_bundle(bundle, filter, pk_val)
         query = view_session.query(self.model)
 
         if pk_val is not None:
@@ -155,6 +283,26 @@ class ModelAPI(MethodView):
             result = query.all()
             return result
 
+    def get_from_bundle(self, bundle, filter, pk_val):
+        table = self.model.__tablename__
+        if pk_val is not None:
+            filter[self.pk_name] = pk_val
+        if len(filter.keys()) == 0:
+            return [record for _, record in sorted(
+                bundle.all(table).items(), key=lambda r: int(r[0]))]
+        if 'id' in filter:
+            records = [bundle.get(table, filter['id'])]
+        elif 'name' in filter:
+            records = [bundle.find(table, filter['name'])]
+        else:
+            records = bundle.all(table).values()
+        for record in records:
+            if record is not None and all(
+                    str(record.get(field)) == str(value)
+                    for field, value in filter.items()):
+                return record
+        return None
+
 
 class ChampionAPI(ModelAPI):
 
@@ -199,7 +347,8 @@ class MatchupAPI(MethodView):
                  (MatchupAverages.enemy == champion))
             ).all()
             matchup_avgs = [v.serialize() for v in matchup_avgs]
-            return create_success_response(matchup_avg)
+            return create_success_response(matchup_avgs,
+                                           max_age=MATCHUP_MAX_AGE)
         else:
             matchup_avg = view_session.query(MatchupAverages).filter(
                 (MatchupAverages.champion == champion) & (
@@ -208,4 +357,11 @@ class MatchupAPI(MethodView):
         if matchup_avg is None:
             return create_error_response('Not found', 404)
         else:
-            return create_success_response(matchup_avg.serialize())
+            return create_success_response(matchup_avg.serialize(),
+                                           max_age=MATCHUP_MAX_AGE)
+
+
+class CacheStatsAPI(MethodView):
+
+    def get(self):
+        return create_success_response(cache_stats.totals(), max_age=0)
@@ -1,7 +1,17 @@
 import requests
 import time
 import io
+import os
+import json
 import hashlib
+import tempfile
+import asyncio
+import random
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import aiohttp
 
 
 class ForbiddenException(Exception):
@@ -14,16 +24,252 @@ class NotFound(Exception):
         super(NotFound, self).__init__(message)
 
 
+class TooManyRetries(Exception):
+    def __init__(self, message):
+        super(TooManyRetries, self).__init__(message)
+
+
+class TokenBucket(object):
+
+    # A share of each limit is allowed as a burst and the rest refills
+    # evenly, so that no window of `seconds` ever sees more than `limit`
+    # requests, wherever it starts
+    BURST_RATIO = 0.1
+
+    def __init__(self, limit, seconds):
+        self.limit = limit
+        self.seconds = seconds
+        self.burst = max(1, int(limit * self.BURST_RATIO))
+        self.rate = (limit - self.burst) / seconds or limit / seconds
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter(object):
+
+    """
+    Client side rate limiting shared by every client and thread using the
+    same API key. Each host gets its own token bucket per limit window.
+    Requests reserve a token from every bucket and wait until all of them
+    are covered, so they queue up before Riot would answer with a 429.
+    The limits and counts Riot reports in its response headers override
+    the configured ones.
+    """
+
+    LIMIT_HEADERS = ['X-App-Rate-Limit']
+    COUNT_HEADERS = ['X-App-Rate-Limit-Count', 'X-Rate-Limit-Count']
+
+    def __init__(self, limits=((10, 1), (500, 600))):
+        self.limits = list(limits)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _buckets(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = {seconds: TokenBucket(limit, seconds)
+                                  for limit, seconds in self.limits}
+        return self.buckets[host]
+
+    def reserve(self, host):
+        """
+        Takes a token for one request to host and returns how many seconds
+        the caller has to wait before sending it
+        """
+        with self.lock:
+            now = time.monotonic()
+            delay = 0
+            for bucket in self._buckets(host).values():
+                bucket.refill(now)
+                bucket.tokens -= 1
+                if bucket.tokens < 0:
+                    delay = max(delay, -bucket.tokens / bucket.rate)
+            return delay
+
+    def acquire(self, host):
+        delay = self.reserve(host)
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, host, seconds):
+        """
+        Holds back every request to host for at least seconds
+        """
+        with self.lock:
+            now = time.monotonic()
+            for bucket in self._buckets(host).values():
+                bucket.refill(now)
+                bucket.tokens = min(bucket.tokens, -seconds * bucket.rate)
+
+    def update(self, host, headers):
+        limits = self.parse_header(headers, self.LIMIT_HEADERS)
+        counts = self.parse_header(headers, self.COUNT_HEADERS)
+        if not limits and not counts:
+            return
+        with self.lock:
+            buckets = self._buckets(host)
+            for seconds, limit in limits.items():
+                bucket = buckets.get(seconds)
+                if bucket is None or bucket.limit != limit:
+                    buckets[seconds] = TokenBucket(limit, seconds)
+            now = time.monotonic()
+            for seconds, count in counts.items():
+                bucket = buckets.get(seconds)
+                if bucket is not None:
+                    bucket.refill(now)
+                    bucket.tokens = min(bucket.tokens, bucket.limit - count)
+
+    @staticmethod
+    def parse_header(headers, names):
+        # Riot sends windows as "value:seconds,value:seconds"
+        for name in names:
+            value = headers.get(name)
+            if value is None:
+                continue
+            try:
+                return {int(seconds): int(amount) for amount, seconds in
+                        (window.split(':') for window in value.split(','))}
+            except ValueError:
+                continue
+        return {}
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Binary file that replaces path once the block exits without raising,
+    so a reader never sees it half written. Missing directories are
+    created
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ResponseCache(object):
+
+    """
+    Persistent cache of GET responses, keyed by URL and query parameters
+    (minus the API key). Responses to requests that name a `version` never
+    change and are kept forever. Everything else expires after the TTL of
+    the longest endpoint prefix in ttls, or default_ttl, and is then
+    revalidated with If-None-Match / If-Modified-Since when the server
+    sent an ETag or Last-Modified.
+    """
+
+    def __init__(self, path, ttls=None, default_ttl=3600,
+                 ignored_params=('api_key',)):
+        self.path = path
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.ignored_params = set(ignored_params)
+
+    def key(self, url, payload):
+        params = sorted((str(k), str(v)) for k, v in (payload or {}).items()
+                        if k not in self.ignored_params)
+        return hashlib.sha1(
+            json.dumps([url, params]).encode('utf-8')).hexdigest()
+
+    def ttl(self, endpoint, payload):
+        if payload is not None and payload.get('version') is not None:
+            return None
+        prefixes = [p for p in self.ttls if (endpoint or '').startswith(p)]
+        if len(prefixes) == 0:
+            return self.default_ttl
+        return self.ttls[max(prefixes, key=len)]
+
+    def _file(self, key, extension):
+        return os.path.join(self.path, key[:2], '{0}.{1}'.format(
+            key, extension))
+
+    def load(self, key):
+        try:
+            with open(self._file(key, 'json'), 'r') as f:
+                entry = json.load(f)
+            with open(self._file(key, 'body'), 'rb') as f:
+                entry['body'] = f.read()
+        except (IOError, ValueError):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return (entry['ttl'] is None or
+                time.time() - entry['fetched_at'] < entry['ttl'])
+
+    def validators(self, entry):
+        headers = {}
+        if entry.get('etag') is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified') is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key, ttl, body, headers):
+        entry = {
+            'fetched_at': time.time(),
+            'ttl': ttl,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+        self._write(self._file(key, 'body'), body)
+        self._write(self._file(key, 'json'),
+                    json.dumps(entry).encode('utf-8'))
+
+    def touch(self, key, entry):
+        # A 304 means the body we have is still current
+        entry = {k: v for k, v in entry.items() if k != 'body'}
+        entry['fetched_at'] = time.time()
+        self._write(self._file(key, 'json'),
+                    json.dumps(entry).encode('utf-8'))
+
+    def _write(self, path, data):
+        with atomic_write(path) as f:
+            f.write(data)
+
+
 class RESTClient(object):
 
+    """
+    Requests go through one keep-alive session per host. timeout is the
+    read timeout of each request. Failed requests are retried up to
+    max_attempts times, waiting Retry-After when the server sends one and
+    a capped exponential backoff with full jitter otherwise.
+    """
+
     base_url = ''
     timeout = 10
 
-    def __init__(self, base_url='', timeout=10, log=None):
+    def __init__(self, base_url='', timeout=10, log=None, rate_limiter=None,
+                 connect_timeout=3.05, max_attempts=5, backoff=1,
+                 max_backoff=60, pool_size=10, cache=None):
         self.base_url = base_url
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
         self.log = log
         self.headers = {}
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        self.cache = cache
 
     def get(self, url=None, endpoint=None,
             payload=None, response_type='json'):
@@ -34,71 +280,238 @@ class RESTClient(object):
         else:
             raise Exception('Unknown url')
         url_hash = hashlib.md5(_url.encode('utf-8')).hexdigest()[:6]
+        cached = None
+        headers = {}
+        if self.cache is not None:
+            cache_key = self.cache.key(_url, payload)
+            cached = self.cache.load(cache_key)
+            if cached is not None:
+                if self.cache.is_fresh(cached):
+                    self.log.debug('[GET {0}] {1}, params={2} (cached)'.format(
+                        url_hash, _url, payload))
+                    return self.decode(cached['body'], response_type)
+                headers = self.cache.validators(cached)
         self.log.debug('[GET {0}] {1}, params={2}'.format(
             url_hash, _url, payload))
         try:
-            response = requests.get(_url, params=payload, headers=self.headers)
-            if self.timeout > 0:
-                while not self.handle_response(response, url_hash):
-                    response = requests.get(_url, params=payload,
-                                            headers=self.headers)
+            host = urlparse(_url).netloc
+            attempt = 0
+            while True:
+                try:
+                    response = self.request(_url, payload, headers)
+                    if response.status_code == 304 and cached is not None:
+                        self.log.info(
+                            '[{0} status=304] Not Modified!'.format(url_hash))
+                        self.cache.touch(cache_key, cached)
+                        return self.decode(cached['body'], response_type)
+                    delay = self.retry_delay(response.status_code,
+                                             response.headers, url_hash,
+                                             attempt)
+                    if delay is None:
+                        break
+                    paused = (response.status_code == 429 and
+                              self.rate_limiter is not None)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    delay = self.backoff_delay(attempt)
+                    paused = False
+                    self.log.error(
+                        '[{0}] {1}! Retrying after {2:.2f} seconds...'
+                        .format(url_hash, e.__class__.__name__, delay))
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise TooManyRetries(
+                        'Giving up on {0} after {1} attempts'.format(
+                            _url, attempt))
+                if paused:
+                    # Every thread sharing the limiter backs off, not just
+                    # this one
+                    self.rate_limiter.pause(host, delay)
+                else:
+                    time.sleep(delay)
         except ForbiddenException as e:
             raise e
         except NotFound as e:
             raise e
         except Exception as e:
             raise e
+        if self.cache is not None:
+            self.cache.store(cache_key, self.cache.ttl(endpoint, payload),
+                             response.content, response.headers)
+        return self.decode(response.content, response_type)
+
+    def decode(self, content, response_type):
         # TODO: Check Content-Type Header
         if response_type == 'json':
-            return response.json()
+            return json.loads(content.decode('utf-8'))
         elif response_type == 'byte-stream':
-            return io.BytesIO(response.content)
+            return io.BytesIO(content)
         elif response_type == 'any':
-            return response.content
+            return content
 
     def set_header(header_name=None, header_val=None):
         if header_name and header_val:
             self.headers[header_name] = header_val
 
-    def handle_response(self, response, hash):
-        if response.status_code != 200:
-            if response.status_code == 403:
+    def session(self, host):
+        with self.sessions_lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate'
+                self.sessions[host] = session
+            return session
+
+    def request(self, url, payload, headers=None):
+        host = urlparse(url).netloc
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(host)
+        response = self.session(host).get(
+            url, params=payload,
+            headers=dict(self.headers, **(headers or {})),
+            timeout=(self.connect_timeout, self.timeout))
+        if self.rate_limiter is not None:
+            self.rate_limiter.update(host, response.headers)
+        return response
+
+    def backoff_delay(self, attempt):
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry_delay(self, status_code, headers, hash, attempt=0):
+        """
+        Seconds to wait before retrying a request that got status_code back
+        on its attempt-th try, None if it succeeded
+        """
+        if status_code != 200:
+            if status_code == 403:
                 raise ForbiddenException('Forbidden Endpoint')
-            elif response.status_code == 404:
+            elif status_code == 404:
                 self.log.error(
                     '[{0} status=404] Resource not Found! '
                     'exiting...'
                     .format(hash))
                 raise NotFound('Forbidden Endpoint')
-            elif response.status_code == 429:
-                rate_limit_header = response.headers.get('X-Rate-Limit-Type')
+            elif status_code == 429:
+                rate_limit_header = headers.get('X-Rate-Limit-Type')
                 # If we actaully exceeded the requests that we were supposed
                 # to do in a given amount of time
                 if rate_limit_header is not None:
-                    retry_after = response.headers.get('Retry-After', 10)
+                    retry_after = headers.get('Retry-After', 10)
                     self.log.error('[{0} status=429] Rate Limit Exceeded! Type: {1}. '
                                    'Retrying after {2} seconds...'.format(
                                     hash, rate_limit_header, retry_after))
-                    time.sleep(int(retry_after))
+                    return int(retry_after)
                 else:
+                    delay = self.backoff_delay(attempt)
                     self.log.error(
                         '[{0} status=429] Rate Limit Exceeded because of the '
-                        'underlying service! Retrying after {1} seconds...'
-                        .format(hash, self.timeout))
-                    time.sleep(self.timeout)
-            elif response.status_code >= 500:
+                        'underlying service! Retrying after {1:.2f} seconds...'
+                        .format(hash, delay))
+                    return delay
+            elif status_code >= 500:
+                delay = self.backoff_delay(attempt)
                 self.log.error(
-                    '[{0} status={1}] Service unavailable! Sleeping for {2} '
-                    'seconds'.format(hash, response.status_code, self.timeout))
-                time.sleep(self.timeout)
+                    '[{0} status={1}] Service unavailable! Sleeping for '
+                    '{2:.2f} seconds'.format(hash, status_code, delay))
+                return delay
             else:
+                delay = self.backoff_delay(attempt)
                 self.log.error(
                     '[{0} status={1}] Unknown Error! '
-                    'sleeping just in case...'
-                    .format(hash, response.status_code))
-                time.sleep(self.timeout)
-
-            return False
+                    'sleeping {2:.2f} seconds just in case...'
+                    .format(hash, status_code, delay))
+                return delay
 
         self.log.info('[{0} status=200] Ok!'.format(hash))
-        return True
+        return None
+
+
+class AsyncRESTClient(RESTClient):
+
+    """
+    Fetches many resources concurrently from a private event loop, with at
+    most `concurrency` requests in flight. Requests wait on the rate
+    limiter, shared with the blocking clients, before being sent.
+    """
+
+    def __init__(self, base_url='', timeout=10, concurrency=10, log=None,
+                 rate_limiter=None, **kwargs):
+        super(AsyncRESTClient, self).__init__(base_url=base_url,
+                                              timeout=timeout, log=log,
+                                              rate_limiter=rate_limiter,
+                                              **kwargs)
+        self.concurrency = concurrency
+
+    def fetch_all(self, requests, callback):
+        """
+        requests is an iterable of (key, url, endpoint, payload) tuples.
+        callback(key, result, error) is called from the calling thread as
+        soon as each request finishes, in completion order.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._fetch_all(requests, callback))
+        finally:
+            loop.close()
+
+    async def _fetch_all(self, requests, callback):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [asyncio.ensure_future(
+                self._fetch(session, semaphore, key, url, endpoint, payload))
+                for key, url, endpoint, payload in requests]
+            for task in asyncio.as_completed(tasks):
+                key, result, error = await task
+                callback(key, result, error)
+
+    async def _fetch(self, session, semaphore, key, url, endpoint, payload):
+        if url is None:
+            url = self.base_url
+        _url = '{0}{1}'.format(url, endpoint)
+        url_hash = hashlib.md5(_url.encode('utf-8')).hexdigest()[:6]
+        host = urlparse(_url).netloc
+        async with semaphore:
+            try:
+                for attempt in range(self.max_attempts):
+                    if self.rate_limiter is not None:
+                        await asyncio.sleep(self.rate_limiter.reserve(host))
+                    self.log.debug('[GET {0}] {1}, params={2}'.format(
+                        url_hash, _url, payload))
+                    try:
+                        status, headers, result = await asyncio.wait_for(
+                            self._request(session, _url, payload),
+                            self.connect_timeout + self.timeout)
+                    except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                        delay = self.backoff_delay(attempt)
+                        self.log.error(
+                            '[{0}] {1}! Retrying after {2:.2f} seconds...'
+                            .format(url_hash, e.__class__.__name__, delay))
+                        await asyncio.sleep(delay)
+                        continue
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.update(host, headers)
+                    delay = self.retry_delay(status, headers, url_hash,
+                                             attempt)
+                    if delay is None:
+                        return key, result, None
+                    if status == 429 and self.rate_limiter is not None:
+                        self.rate_limiter.pause(host, delay)
+                    else:
+                        await asyncio.sleep(delay)
+                raise TooManyRetries('Giving up on {0} after {1} attempts'
+                                     .format(_url, self.max_attempts))
+            except Exception as e:
+                return key, None, e
+
+    async def _request(self, session, url, payload):
+        async with session.get(url, params=payload) as response:
+            result = None
+            if response.status == 200:
+                result = await response.json()
+            return response.status, response.headers, result
@@ -60,6 +60,7 @@ def create_database():
     command.upgrade(cfg, "head")
     log.info('Done applying migrations')
     StaticDataContext.populate_static_data()
+    StaticDataContext.write_static_bundle()
     StaticDataContext.generate_static_images()
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+import json
+import random
+import unittest
+
+from benchmarks.timelines_average import filter_path
+from onevone import aggregation
+
+
+def trie_path(data):
+    trie = aggregation.PathTrie()
+    trie.extend(data)
+    return trie.most_common_path()
+
+
+def dumped_path(data):
+    trie = aggregation.PathTrie()
+    trie.extend(data)
+    return aggregation.most_common_path(json.loads(json.dumps(trie.dump())))
+
+
+class MostCommonPathTest(unittest.TestCase):
+
+    TIES = [
+        ([[2], [3, 1], [3, 2]], [3, 2]),
+        ([[1, 2], [2, 1]], [1, 2]),
+        ([[5, 9], [5, 7], [7], [9]], [5, 9]),
+        ([[4], [1, 3], [1, 4]], [1, 4]),
+        ([[3, 2, 1], [3, 1, 2], [1]], [3, 2, 1]),
+        ([[], [2], [1]], [2]),
+    ]
+
+    def random_inputs(self, count=2000):
+        rnd = random.Random(0)
+        for _ in range(count):
+            yield [[rnd.randint(1, 4) for _ in range(rnd.randint(0, 5))]
+                   for _ in range(rnd.randint(0, 8))]
+
+    def test_ties_go_to_the_value_seen_first(self):
+        for data, expected in self.TIES:
+            self.assertEqual(filter_path(data), expected)
+            self.assertEqual(trie_path(data), expected)
+            self.assertEqual(dumped_path(data), expected)
+
+    def test_matches_filter_walk(self):
+        for data in self.random_inputs():
+            expected = filter_path(data)
+            self.assertEqual(trie_path(data), expected, data)
+            self.assertEqual(dumped_path(data), expected, data)
+
+    def test_merged_dumps_match_filter_walk(self):
+        rnd = random.Random(1)
+        for data in self.random_inputs():
+            split = rnd.randint(0, len(data))
+            stored = json.loads(json.dumps(
+                aggregation.path_trie(data[:split])))
+            merged = aggregation.merge_paths(
+                stored, aggregation.path_trie(data[split:]))
+            self.assertEqual(aggregation.most_common_path(merged),
+                             filter_path(data), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+os.environ.setdefault('ONEVONE_PRODUCTION_DB', 'postgresql://localhost/onevone')
+os.environ.setdefault('RIOT_API_KEY', 'test')
+
+from onevone import aggregation
+from onevone.utils import MatchContext, StaticDataContext
+from rest.restclient import TooManyRetries
+
+PathRow = namedtuple('PathRow', ['champion', 'enemy', 'masteries', 'runes',
+                                 'summoners', 'spell_timeline',
+                                 'item_timeline'])
+
+MASTERY_TREE = {
+    'branches': [{'name': 'Ferocity', 'levels': [[0, None], [1]]}],
+    'masteries': [{'id': 6111, 'name': 'Fury'},
+                  {'id': 6121, 'name': 'Sorcery'}],
+    'slots': {'6111': 0, '6121': 1},
+}
+
+
+def objects_by_ids(model, ids):
+    return {str(i): {'id': int(i), 'name': '{0} {1}'.format(
+        model.__name__, i)} for i in ids}
+
+
+class RenderPayloadTest(unittest.TestCase):
+
+    def aggregated_pair(self):
+        """
+        Averages of one pair, as populate_averages computes them
+        """
+        numeric = [
+            (1, 2, '7.1', True, 5, 2, 7, 15000.0, 180, 1800),
+            (1, 2, '7.1', False, 1, 6, 3, 9000.0, 150, 1500),
+        ]
+        paths = [
+            PathRow(1, 2, ['6111:5', '6121:1'], ['5245:9'], '4,14',
+                    [1, 2, 3, 1], [1055, 2003, 3006, 3031]),
+            PathRow(1, 2, ['6111:5'], ['5245:9'], '14,4',
+                    [1, 3, 2, 1], [1055, 2003, 3031]),
+        ]
+        stats = dict(aggregation.matchup_statistics(numeric)[(1, 2, '7.1')],
+                     **aggregation.path_statistics(paths))
+        return dict(aggregation.averages(stats), champion=1, enemy=2,
+                    patch_version='7.1')
+
+    @mock.patch.object(StaticDataContext, 'get_objects_by_ids',
+                       side_effect=objects_by_ids)
+    @mock.patch.object(StaticDataContext, 'get_mastery_tree_template',
+                       return_value=MASTERY_TREE)
+    def test_renders_aggregated_pair(self, *_):
+        payload = MatchContext.render_payload(self.aggregated_pair())
+        self.assertIsNotNone(payload)
+        self.assertEqual(payload['stats']['total_games'], 2)
+        self.assertEqual([s['id'] for s in payload['summoners']], [14, 4])
+        self.assertEqual([r['id'] for r in payload['runes']], [5245])
+        self.assertEqual(payload['mastery_tree'][0]['data'][0][0]['points'],
+                         5)
+
+    @mock.patch.object(StaticDataContext, 'get_objects_by_ids',
+                       side_effect=objects_by_ids)
+    @mock.patch.object(StaticDataContext, 'get_mastery_tree_template',
+                       side_effect=TooManyRetries('Giving up'))
+    def test_unreachable_api_skips_payload(self, *_):
+        self.assertIsNone(
+            MatchContext.render_payload(self.aggregated_pair()))
+
+
+if __name__ == '__main__':
+    unittest.main()
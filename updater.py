@@ -2,8 +2,10 @@ import logging
 import threading
 import json
 from onevone import log
-from onevone.utils import (StaticDataContext, MatchContext)
+from onevone.utils import (StaticDataContext, MatchContext,
+                            API_VERSION_FILE)
 from daemon import Daemon
+from rest.restclient import TooManyRetries
 import sys
 
 MINUTE = 60
@@ -39,7 +41,13 @@ class IntervalWorker(object):
     def execute(self):
         if not self.is_running:
             self.is_running = True
-            self.action(*self.args, **self.kwargs)
+            # A failed run, e.g. while the Riot API is down, must not stop
+            # the worker for good
+            try:
+                self.action(*self.args, **self.kwargs)
+            except Exception:
+                log.exception('Worker {0} failed. Retrying in {1} '
+                              'seconds...'.format(self.action, self.interval))
         else:
             log.ward('Worker {0} already running. Restarting...'.format(
                 self.action))
@@ -54,8 +62,14 @@ class IntervalWorker(object):
 class UpdaterDaemon(Daemon):
 
     def check_version(self):
-        latest_versions = StaticDataContext.get_api_version()['versions'][:10]
-        with open('/var/tmp/onevone/api_version.json', 'r+') as v:
+        try:
+            latest_versions = StaticDataContext.get_api_version.refresh()[
+                'versions'][:10]
+        except TooManyRetries as e:
+            log.error('Could not check for a new version: {0}'.format(
+                repr(e)))
+            return True
+        with open(API_VERSION_FILE, 'r+') as v:
             versions = json.load(v)
             current_version = versions['versions'][0]
             if current_version is None or latest_versions[0] > current_version:
@@ -71,7 +85,13 @@ class UpdaterDaemon(Daemon):
         if not self.check_version():
             log.warn('Older version detected. Updating Static Tables')
             StaticDataContext.populate_static_data()
+            StaticDataContext.write_static_bundle()
             StaticDataContext.generate_static_images()
+            MatchContext.warm_matchups()
+
+    def update_averages(self):
+        MatchContext.populate_averages()
+        MatchContext.warm_matchups()
 
     def run(self):
         self.update_static_data()
@@ -88,8 +108,7 @@ class UpdaterDaemon(Daemon):
             matchup_worker = IntervalWorker(30*MINUTE,
                                             MatchContext.populate_matchups,
                                             region=region, limit=125)
-        average_calc_worker = IntervalWorker(DAY,
-                                             MatchContext.populate_averages)
+        average_calc_worker = IntervalWorker(DAY, self.update_averages)
 
 
 if __name__ == "__main__":